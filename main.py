@@ -13,18 +13,24 @@ Sécurité : AUCUN exec() — le LLM retourne du XML, pas du code.
 """
 
 import asyncio
+import functools
+import hashlib
 import io
 import json
 import logging
 import os
 import re
 import tempfile
+import threading
 import uuid
+from collections import OrderedDict
 from pathlib import Path
+from typing import BinaryIO
 
 import httpx
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pptx import Presentation
 from pptx.util import Inches
 from lxml import etree
@@ -69,6 +75,15 @@ STYLE_CONFIG_PATH = os.environ.get("STYLE_CONFIG_PATH", "/app/sia_theme.md")
 # Retry
 MAX_RETRIES = int(os.environ.get("MAX_RETRIES", "4"))
 
+PPTX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.presentationml.presentation"
+
+# Nombre max d'appels MCP tools/call traités en parallèle (LLM + repack)
+MAX_CONCURRENCY = int(os.environ.get("PPTX_MAX_CONCURRENCY", "4"))
+
+# Uploads — lus par blocs de 1 Mo, gardés en RAM jusqu'à 32 Mo puis basculés sur disque
+UPLOAD_CHUNK_SIZE = 1 << 20
+UPLOAD_SPOOL_MAX_SIZE = 32 * 1024 * 1024
+
 # ============================================================
 # Initialisation
 # ============================================================
@@ -89,7 +104,7 @@ async def save_to_siagpt_medias(data: bytes, filename: str, auth_token: str) ->
     async with httpx.AsyncClient(timeout=60.0) as client:
         response = await client.post(
             f"{SIAGPT_MEDIAS_URL}/",
-            files={"file": (filename, data, "application/vnd.openxmlformats-officedocument.presentationml.presentation")},
+            files={"file": (filename, data, PPTX_MEDIA_TYPE)},
             data={"media_metadata": media_metadata},
             headers={"Authorization": f"Bearer {auth_token}"},
         )
@@ -121,6 +136,20 @@ async def download_from_siagpt_medias(file_uuid: str, auth_token: str) -> tuple[
         return dl_response.content, filename
 
 
+async def spool_upload(file: UploadFile) -> tempfile.SpooledTemporaryFile:
+    """
+    Copie un UploadFile par blocs dans un SpooledTemporaryFile.
+    Évite de charger tout l'upload en mémoire d'un coup : au-delà de
+    UPLOAD_SPOOL_MAX_SIZE, le contenu bascule automatiquement sur disque.
+    Le fichier retourné est rembobiné (seek(0)), à fermer par l'appelant.
+    """
+    spooled = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX_SIZE)
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        spooled.write(chunk)
+    spooled.seek(0)
+    return spooled
+
+
 def load_system_prompt() -> str:
     """
     Charge le system prompt + la config style.
@@ -147,9 +176,16 @@ SYSTEM_PROMPT = load_system_prompt()
 # Inspection PPTX
 # ============================================================
 
-def inspect_pptx_structure(pptx_bytes: bytes) -> str:
+def _as_pptx_file(pptx_bytes: bytes | BinaryIO) -> BinaryIO:
+    """Accepte des bytes ou un fichier ouvert (ex: upload spoolé), retourne un fichier."""
+    if isinstance(pptx_bytes, (bytes, bytearray)):
+        return io.BytesIO(pptx_bytes)
+    return pptx_bytes
+
+
+def inspect_pptx_structure(pptx_bytes: bytes | BinaryIO) -> str:
     """Inspecte la structure complète d'un PPTX, retourne du JSON."""
-    prs = Presentation(io.BytesIO(pptx_bytes))
+    prs = Presentation(_as_pptx_file(pptx_bytes))
 
     structure = {
         "slide_width_emu": str(prs.slide_width),
@@ -205,9 +241,35 @@ def inspect_pptx_structure(pptx_bytes: bytes) -> str:
     return json.dumps(structure, ensure_ascii=False, indent=2)
 
 
-def inspect_slide_xml(pptx_bytes: bytes, slide_index: int) -> str:
+# Cache des structures inspectées, indexé par empreinte BLAKE2b du contenu.
+# On ne garde que l'empreinte et le JSON (pas les bytes du PPTX) : un template
+# réutilisé d'une requête à l'autre n'est parsé qu'une fois par python-pptx.
+STRUCTURE_CACHE_SIZE = 128
+_structure_cache: OrderedDict[bytes, str] = OrderedDict()
+_structure_cache_lock = threading.Lock()
+
+
+def inspect_pptx_structure_cached(pptx_bytes: bytes) -> str:
+    """inspect_pptx_structure() mémoïsée par contenu (LRU de STRUCTURE_CACHE_SIZE entrées)."""
+    digest = hashlib.blake2b(pptx_bytes, digest_size=16).digest()
+    with _structure_cache_lock:
+        structure = _structure_cache.get(digest)
+        if structure is not None:
+            _structure_cache.move_to_end(digest)
+            return structure
+
+    structure = inspect_pptx_structure(pptx_bytes)
+
+    with _structure_cache_lock:
+        _structure_cache[digest] = structure
+        while len(_structure_cache) > STRUCTURE_CACHE_SIZE:
+            _structure_cache.popitem(last=False)
+    return structure
+
+
+def inspect_slide_xml(pptx_bytes: bytes | BinaryIO, slide_index: int) -> str:
     """Retourne le XML brut d'un slide."""
-    prs = Presentation(io.BytesIO(pptx_bytes))
+    prs = Presentation(_as_pptx_file(pptx_bytes))
     if slide_index >= len(prs.slides):
         return f"Erreur : slide {slide_index} n'existe pas (max: {len(prs.slides) - 1})"
     slide = prs.slides[slide_index]
@@ -218,15 +280,16 @@ def inspect_slide_xml(pptx_bytes: bytes, slide_index: int) -> str:
 # Unpack / Repack PPTX (workflow d'édition XML)
 # ============================================================
 
-def unpack_pptx(pptx_bytes: bytes, dest_dir: str) -> str:
+def unpack_pptx(pptx_bytes: bytes | BinaryIO, dest_dir: str) -> str:
     """Décompresse un PPTX avec pretty-print XML et smart quotes."""
     unpacked_dir = str(Path(dest_dir) / "unpacked")
     return pptx_tools.unpack(pptx_bytes, unpacked_dir)
 
 
-def repack_pptx(unpacked_dir: str, original_bytes: bytes = None) -> bytes:
+def repack_pptx(unpacked_dir: str, original_bytes: bytes = None, output_path: Path = None) -> bytes | None:
     """
     Repackage avec validation complète, auto-repair, condensation XML et smart quotes.
+    Si output_path est fourni, le PPTX est écrit dans ce fichier (retourne None).
 
     Stratégie (comme Claude le fait manuellement) :
     - Erreurs XSD sur slides → on les signale (le caller peut retenter)
@@ -268,7 +331,7 @@ def repack_pptx(unpacked_dir: str, original_bytes: bytes = None) -> bytes:
             + ("\n  ..." if len(blocking_errors) > 5 else "")
         )
 
-    return pptx_tools.pack(unpacked_dir, original_bytes)
+    return pptx_tools.pack(unpacked_dir, original_bytes, output_path=output_path)
 
 
 # ============================================================
@@ -341,12 +404,23 @@ def validate_xml(xml_string: str) -> tuple[bool, str]:
 
 
 def read_slide_xmls(unpacked_dir: str) -> dict[str, str]:
-    """Lit tous les XML de slides depuis le dossier décompressé."""
-    slides_dir = Path(unpacked_dir) / "ppt" / "slides"
+    """Lit tous les XML de slides depuis le dossier décompressé (ordre numérique : slide2 avant slide10)."""
+    slides_dir = os.path.join(unpacked_dir, "ppt", "slides")
+    if not os.path.isdir(slides_dir):
+        return {}
+
+    entries = []
+    with os.scandir(slides_dir) as it:
+        for entry in it:
+            name = entry.name
+            if name.startswith("slide") and name.endswith(".xml") and name[5:-4].isdigit():
+                entries.append((int(name[5:-4]), name, entry.path))
+    entries.sort()
+
     slides = {}
-    if slides_dir.exists():
-        for slide_file in sorted(slides_dir.glob("slide*.xml")):
-            slides[slide_file.name] = slide_file.read_text(encoding="utf-8")
+    for _, name, path in entries:
+        with open(path, encoding="utf-8") as f:
+            slides[name] = f.read()
     return slides
 
 
@@ -493,28 +567,44 @@ async def apply_xml_modifications(
             results["errors"].append(f"Erreur sur {filename}: {str(e)}")
 
     # Phase 2b : Ajouter des slides (duplication + modification)
+    # Duplication et insertion en lot : [Content_Types].xml, presentation.xml.rels
+    # et presentation.xml ne sont parsés et réécrits qu'une fois pour toutes les slides
+    adds = []
     for add in plan.get("slides_to_add", []):
         source = add.get("duplicate_from", "")
-        instructions = add.get("instructions", "")
-        position = add.get("position", None)
-
         if source not in slide_xmls:
             results["errors"].append(f"Slide source {source} introuvable pour duplication")
             continue
+        adds.append(add)
 
+    dup_infos = []
+    if adds:
         try:
-            # Dupliquer la slide via pptx_tools (gère .rels, Content_Types, notesSlide)
-            dup_info = pptx_tools.duplicate_slide(unpacked_dir, source)
-            new_filename = dup_info["new_filename"]
-
+            # Dupliquer les slides via pptx_tools (gère .rels, Content_Types, notesSlide)
+            dup_infos = pptx_tools.duplicate_slides(
+                unpacked_dir, [add["duplicate_from"] for add in adds]
+            )
             # Ajouter dans presentation.xml à la bonne position
-            pptx_tools.add_slide_to_presentation(
+            pptx_tools.add_slides_to_presentation(
                 unpacked_dir,
-                dup_info["new_sld_id"],
-                dup_info["new_r_id"],
-                position=position,
+                [
+                    (dup_info["new_sld_id"], dup_info["new_r_id"], add.get("position", None))
+                    for add, dup_info in zip(adds, dup_infos)
+                ],
             )
+        except Exception as e:
+            for add in adds:
+                results["errors"].append(
+                    f"Erreur ajout slide depuis {add['duplicate_from']}: {str(e)}"
+                )
+            dup_infos = []
+
+    for add, dup_info in zip(adds, dup_infos):
+        source = add["duplicate_from"]
+        instructions = add.get("instructions", "")
+        new_filename = dup_info["new_filename"]
 
+        try:
             # Modifier le contenu si des instructions sont fournies
             if instructions:
                 new_slide_xml = (slides_dir / new_filename).read_text(encoding="utf-8")
@@ -562,39 +652,69 @@ async def apply_xml_modifications(
 # Fonctions core — logique partagée REST / MCP
 # ============================================================
 
-async def _do_edit(pptx_bytes: bytes, prompt: str, auth_token: str, output_filename: str = None) -> dict:
-    """Logique core d'édition PPTX. Utilisée par REST et MCP."""
+async def _do_edit(
+    pptx_bytes: bytes,
+    prompt: str,
+    auth_token: str,
+    output_filename: str = None,
+    structure: str = None,
+    output_path: Path = None,
+) -> dict:
+    """
+    Logique core d'édition PPTX. Utilisée par REST et MCP.
+    structure : résultat de inspect_pptx_structure() si déjà connu (évite un re-parsing).
+    output_path : si fourni, le PPTX est écrit dans ce fichier au lieu d'être
+                  uploadé dans SiaGPT Medias (l'endpoint le renvoie lui-même).
+    """
     if not output_filename:
         output_filename = f"modified_{uuid.uuid4().hex[:8]}.pptx"
 
-    structure = inspect_pptx_structure(pptx_bytes)
+    # Parsing, unpack et repack (clean + validation XSD + ZIP) sont du travail CPU
+    # synchrone : on l'exécute dans un thread pour ne pas bloquer la boucle asyncio
+    # (les autres requêtes, streams SSE et appels LLM continuent pendant ce temps).
+    if structure is None:
+        structure = await asyncio.to_thread(inspect_pptx_structure_cached, pptx_bytes)
 
     with tempfile.TemporaryDirectory() as tmp_dir:
-        unpacked_dir = unpack_pptx(pptx_bytes, tmp_dir)
+        unpacked_dir = await asyncio.to_thread(unpack_pptx, pptx_bytes, tmp_dir)
         results = await apply_xml_modifications(unpacked_dir, structure, prompt)
-        output_bytes = repack_pptx(unpacked_dir, pptx_bytes)
-
-    media_info = await save_to_siagpt_medias(output_bytes, output_filename, auth_token)
+        output_bytes = await asyncio.to_thread(repack_pptx, unpacked_dir, pptx_bytes, output_path)
 
-    return {
+    summary = {
         "status": "ok",
         "summary": results["plan"].get("summary", ""),
         "modified_slides": results["modified_slides"],
         "added_slides": results["added_slides"],
         "removed_slides": results["removed_slides"],
         "errors": results["errors"],
+    }
+
+    if output_path is not None:
+        return {**summary, "filename": output_filename}
+
+    media_info = await save_to_siagpt_medias(output_bytes, output_filename, auth_token)
+
+    return {
+        **summary,
         "media_uuid": media_info.get("uuid"),
         "media_name": media_info.get("name"),
     }
 
 
-async def _do_create(prompt: str, auth_token: str, template_bytes: bytes = None, output_filename: str = None) -> dict:
-    """Logique core de création PPTX. Utilisée par REST et MCP."""
+async def _do_create(
+    prompt: str,
+    auth_token: str,
+    template_bytes: bytes = None,
+    output_filename: str = None,
+    output_path: Path = None,
+) -> dict:
+    """Logique core de création PPTX. Utilisée par REST et MCP (output_path : voir _do_edit)."""
     if not output_filename:
         output_filename = f"new_{uuid.uuid4().hex[:8]}.pptx"
 
+    structure = None
     if not template_bytes:
-        template_bytes = create_skeleton_pptx(prompt)
+        template_bytes, structure = _cached_skeleton()
 
     create_prompt = (
         f"CRÉATION DE PRÉSENTATION depuis un template.\n\n"
@@ -604,7 +724,30 @@ async def _do_create(prompt: str, auth_token: str, template_bytes: bytes = None,
         f"et modifier tout le contenu texte."
     )
 
-    return await _do_edit(template_bytes, create_prompt, auth_token, output_filename)
+    return await _do_edit(template_bytes, create_prompt, auth_token, output_filename, structure, output_path)
+
+
+async def _respond_with_file(build) -> FileResponse:
+    """
+    Génère le PPTX dans un fichier temporaire et le renvoie via FileResponse.
+    Le serveur envoie le fichier avec sendfile (pas de copie en mémoire),
+    puis le supprime une fois la réponse envoyée.
+
+    build : callable(output_path) → coroutine retournant le dict de _do_edit.
+    """
+    fd, tmp_name = tempfile.mkstemp(suffix=".pptx")
+    os.close(fd)
+    try:
+        result = await build(Path(tmp_name))
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+    return FileResponse(
+        tmp_name,
+        media_type=PPTX_MEDIA_TYPE,
+        filename=result["filename"],
+        background=BackgroundTask(os.unlink, tmp_name),
+    )
 
 
 def _format_mcp_summary(action: str, result: dict, extra_line: str = None) -> str:
@@ -634,13 +777,21 @@ async def edit_pptx(
     prompt: str = Form(...),
     file: UploadFile = File(...),
     output_filename: str = Form(None),
+    return_file: bool = Form(False),
 ):
-    """Modifie un PPTX existant. Mode XML pur."""
+    """
+    Modifie un PPTX existant. Mode XML pur.
+    return_file=true : renvoie directement le .pptx au lieu de l'uploader dans SiaGPT.
+    """
     # Fallback sur LLM_API_KEY pour les appels internes sans token utilisateur
     # (ex: appels MCP depuis SiaGPT où le service agit en son propre nom)
     auth_token = (request.headers.get("authorization", "").removeprefix("Bearer ").strip()) or LLM_API_KEY
     pptx_bytes = await file.read()
     try:
+        if return_file:
+            return await _respond_with_file(
+                lambda path: _do_edit(pptx_bytes, prompt, auth_token, output_filename, output_path=path)
+            )
         return await _do_edit(pptx_bytes, prompt, auth_token, output_filename)
     except ValueError as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -656,12 +807,20 @@ async def create_pptx(
     prompt: str = Form(...),
     template: UploadFile = File(None),
     output_filename: str = Form(None),
+    return_file: bool = Form(False),
 ):
-    """Crée un PPTX depuis un template (ou un squelette vierge). Mode XML pur."""
+    """
+    Crée un PPTX depuis un template (ou un squelette vierge). Mode XML pur.
+    return_file=true : renvoie directement le .pptx au lieu de l'uploader dans SiaGPT.
+    """
     # Fallback sur LLM_API_KEY (voir commentaire dans edit_pptx)
     auth_token = (request.headers.get("authorization", "").removeprefix("Bearer ").strip()) or LLM_API_KEY
     template_bytes = await template.read() if template else None
     try:
+        if return_file:
+            return await _respond_with_file(
+                lambda path: _do_create(prompt, auth_token, template_bytes, output_filename, output_path=path)
+            )
         return await _do_create(prompt, auth_token, template_bytes, output_filename)
     except ValueError as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -692,6 +851,16 @@ def create_skeleton_pptx(prompt: str) -> bytes:
     return buf.getvalue()
 
 
+@functools.lru_cache(maxsize=1)
+def _cached_skeleton() -> tuple[bytes, str]:
+    """
+    Squelette + sa structure inspectée, construits une seule fois.
+    Le squelette ne dépend pas du prompt : inutile de le reconstruire à chaque requête.
+    """
+    skeleton = create_skeleton_pptx("")
+    return skeleton, inspect_pptx_structure(skeleton)
+
+
 # ============================================================
 # Endpoint — Inspection
 # ============================================================
@@ -699,16 +868,16 @@ def create_skeleton_pptx(prompt: str) -> bytes:
 @app.post("/api/inspect")
 async def inspect_pptx(file: UploadFile = File(...)):
     """Retourne la structure d'un PPTX en JSON."""
-    pptx_bytes = await file.read()
-    structure = inspect_pptx_structure(pptx_bytes)
+    with await spool_upload(file) as pptx_file:
+        structure = inspect_pptx_structure(pptx_file)
     return JSONResponse(content=json.loads(structure))
 
 
 @app.post("/api/inspect/xml")
 async def inspect_xml(file: UploadFile = File(...), slide_index: int = Form(0)):
     """Retourne le XML brut d'un slide."""
-    pptx_bytes = await file.read()
-    xml = inspect_slide_xml(pptx_bytes, slide_index)
+    with await spool_upload(file) as pptx_file:
+        xml = inspect_slide_xml(pptx_file, slide_index)
     return {"slide_index": slide_index, "xml": xml}
 
 
@@ -718,7 +887,14 @@ async def inspect_xml(file: UploadFile = File(...), slide_index: int = Form(0)):
 # ============================================================
 
 # Sessions MCP actives : session_id → asyncio.Queue
-mcp_sessions: dict[str, asyncio.Queue] = {}
+# Bornées en nombre (les plus anciennes sont évincées) et chaque queue est bornée
+# en taille : un client qui ne lit plus son stream ne peut pas faire grossir la RAM.
+MCP_MAX_SESSIONS = 1024
+MCP_QUEUE_MAXSIZE = 64
+mcp_sessions: OrderedDict[str, asyncio.Queue] = OrderedDict()
+
+# Limite les tools/call simultanés pour ne pas saturer le LLM en aval
+_TOOL_SEM = asyncio.Semaphore(MAX_CONCURRENCY)
 
 
 def mcp_jsonrpc_response(req_id: str | int | None, result: dict) -> dict:
@@ -737,8 +913,17 @@ async def mcp_sse_get(request: Request):
     Endpoint SSE pour le protocole MCP (ancien transport).
     """
     session_id = uuid.uuid4().hex
-    queue: asyncio.Queue = asyncio.Queue()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=MCP_QUEUE_MAXSIZE)
     mcp_sessions[session_id] = queue
+    while len(mcp_sessions) > MCP_MAX_SESSIONS:
+        evicted_id, evicted_queue = mcp_sessions.popitem(last=False)
+        logger.warning(f"Session MCP {evicted_id} évincée (limite de {MCP_MAX_SESSIONS} atteinte)")
+        # Réveille le stream SSE évincé pour qu'il se ferme (le client se reconnecte) ;
+        # une queue pleine le réveille de toute façon au prochain get()
+        try:
+            evicted_queue.put_nowait(None)
+        except asyncio.QueueFull:
+            pass
 
     async def event_stream():
         scheme = request.headers.get("x-forwarded-proto", "https")
@@ -747,14 +932,19 @@ async def mcp_sse_get(request: Request):
         yield f"event: endpoint\ndata: {endpoint_url}\n\n"
 
         try:
-            while True:
+            # Session évincée (cf. MCP_MAX_SESSIONS) → on ferme le stream : ses
+            # réponses n'y arriveraient plus
+            while mcp_sessions.get(session_id) is queue:
                 if await request.is_disconnected():
                     break
                 try:
                     message = await asyncio.wait_for(queue.get(), timeout=30.0)
-                    yield f"event: message\ndata: {json.dumps(message)}\n\n"
                 except asyncio.TimeoutError:
                     yield ": keepalive\n\n"
+                    continue
+                if message is None:
+                    break
+                yield f"event: message\ndata: {json.dumps(message)}\n\n"
         finally:
             mcp_sessions.pop(session_id, None)
 
@@ -769,81 +959,92 @@ async def mcp_sse_get(request: Request):
     )
 
 
+# Réponses MCP statiques — construites une seule fois à l'import.
+# Elles ne sont jamais modifiées : on peut les renvoyer telles quelles à chaque requête.
+_MCP_INITIALIZE_RESULT = {
+    "protocolVersion": "2024-11-05",
+    "capabilities": {"tools": {"listChanged": False}},
+    "serverInfo": {"name": "pptx-service", "version": "1.0.0"},
+}
+
+_MCP_TOOLS_LIST = {
+    "tools": [
+        {
+            "name": "generate_pptx",
+            "description": "Génère une présentation PowerPoint à partir d'une description textuelle. Peut utiliser un template existant comme base (recommandé pour les présentations Sia Partners). Le fichier est sauvegardé dans la collection SiaGPT.",
+            "inputSchema": {
+                "type": "object",
+                "properties": {
+                    "prompt": {
+                        "type": "string",
+                        "description": "Description de la présentation à créer (contenu, nombre de slides, style...)",
+                    },
+                    "template_file_id": {
+                        "type": "string",
+                        "description": "UUID d'un template PPTX dans la collection SiaGPT à utiliser comme base. Si omis, crée un squelette vierge.",
+                    }
+                },
+                "required": ["prompt"],
+            },
+        },
+        {
+            "name": "edit_pptx",
+            "description": "Modifie une présentation PowerPoint existante dans la collection SiaGPT. Récupère le fichier par son UUID, applique les modifications demandées, et uploade la version modifiée.",
+            "inputSchema": {
+                "type": "object",
+                "properties": {
+                    "prompt": {
+                        "type": "string",
+                        "description": "Description des modifications à apporter (ex: changer les couleurs, ajouter une slide, modifier le texte...)",
+                    },
+                    "source_file_id": {
+                        "type": "string",
+                        "description": "UUID du fichier PPTX dans la collection SiaGPT à modifier",
+                    }
+                },
+                "required": ["prompt", "source_file_id"],
+            },
+        }
+    ]
+}
+
+
 async def handle_mcp_request(body: dict, session_id: str = "") -> tuple[dict, str]:
     """
     Traite une requête JSON-RPC MCP et retourne (réponse, session_id).
     """
-    method = body.get("method", "")
     req_id = body.get("id")
-    params = body.get("params", {})
-
-    # --- initialize ---
-    if method == "initialize":
-        if not session_id:
-            session_id = uuid.uuid4().hex
-        return mcp_jsonrpc_response(req_id, {
-            "protocolVersion": "2024-11-05",
-            "capabilities": {"tools": {"listChanged": False}},
-            "serverInfo": {"name": "pptx-service", "version": "1.0.0"},
-        }), session_id
-
-    # --- notifications/initialized ---
-    if method == "notifications/initialized":
-        return None, session_id
-
-    # --- tools/list ---
-    if method == "tools/list":
-        return mcp_jsonrpc_response(req_id, {
-            "tools": [
-                {
-                    "name": "generate_pptx",
-                    "description": "Génère une présentation PowerPoint à partir d'une description textuelle. Peut utiliser un template existant comme base (recommandé pour les présentations Sia Partners). Le fichier est sauvegardé dans la collection SiaGPT.",
-                    "inputSchema": {
-                        "type": "object",
-                        "properties": {
-                            "prompt": {
-                                "type": "string",
-                                "description": "Description de la présentation à créer (contenu, nombre de slides, style...)",
-                            },
-                            "template_file_id": {
-                                "type": "string",
-                                "description": "UUID d'un template PPTX dans la collection SiaGPT à utiliser comme base. Si omis, crée un squelette vierge.",
-                            }
-                        },
-                        "required": ["prompt"],
-                    },
-                },
-                {
-                    "name": "edit_pptx",
-                    "description": "Modifie une présentation PowerPoint existante dans la collection SiaGPT. Récupère le fichier par son UUID, applique les modifications demandées, et uploade la version modifiée.",
-                    "inputSchema": {
-                        "type": "object",
-                        "properties": {
-                            "prompt": {
-                                "type": "string",
-                                "description": "Description des modifications à apporter (ex: changer les couleurs, ajouter une slide, modifier le texte...)",
-                            },
-                            "source_file_id": {
-                                "type": "string",
-                                "description": "UUID du fichier PPTX dans la collection SiaGPT à modifier",
-                            }
-                        },
-                        "required": ["prompt", "source_file_id"],
-                    },
-                }
-            ]
-        }), session_id
 
-    # --- tools/call ---
-    if method == "tools/call":
-        tool_name = params.get("name", "")
-        tool_args = params.get("arguments", {})
+    match body.get("method", ""):
+        case "initialize":
+            if not session_id:
+                session_id = uuid.uuid4().hex
+            return mcp_jsonrpc_response(req_id, _MCP_INITIALIZE_RESULT), session_id
+
+        case "notifications/initialized":
+            return None, session_id
+
+        case "tools/list":
+            return mcp_jsonrpc_response(req_id, _MCP_TOOLS_LIST), session_id
+
+        case "tools/call":
+            return await _handle_mcp_tool_call(req_id, body.get("params", {})), session_id
 
-        if tool_name == "generate_pptx":
+        case method:
+            return mcp_jsonrpc_error(req_id, -32601, f"Méthode inconnue : {method}"), session_id
+
+
+async def _handle_mcp_tool_call(req_id: str | int | None, params: dict) -> dict:
+    """Exécute un tools/call MCP (generate_pptx / edit_pptx) et retourne la réponse JSON-RPC."""
+    tool_name = params.get("name", "")
+    tool_args = params.get("arguments", {})
+
+    match tool_name:
+        case "generate_pptx":
             prompt = tool_args.get("prompt", "")
             template_file_id = tool_args.get("template_file_id", "")
             if not prompt:
-                return mcp_jsonrpc_error(req_id, -32602, "Le paramètre 'prompt' est requis"), session_id
+                return mcp_jsonrpc_error(req_id, -32602, "Le paramètre 'prompt' est requis")
 
             try:
                 # Si un template est fourni, le télécharger depuis SiaGPT Medias
@@ -853,37 +1054,38 @@ async def handle_mcp_request(body: dict, session_id: str = "") -> tuple[dict, st
                     template_bytes, template_name = await download_from_siagpt_medias(template_file_id, LLM_API_KEY)
                     template_info = f"Template : {template_name} ({template_file_id})"
 
-                result = await _do_create(prompt, LLM_API_KEY, template_bytes)
+                async with _TOOL_SEM:
+                    result = await _do_create(prompt, LLM_API_KEY, template_bytes)
                 summary = _format_mcp_summary("créée", result, template_info)
                 return mcp_jsonrpc_response(req_id, {
                     "content": [{"type": "text", "text": summary}]
-                }), session_id
+                })
             except Exception as e:
-                return mcp_jsonrpc_error(req_id, -32000, str(e)), session_id
+                return mcp_jsonrpc_error(req_id, -32000, str(e))
 
-        if tool_name == "edit_pptx":
+        case "edit_pptx":
             prompt = tool_args.get("prompt", "")
             source_file_id = tool_args.get("source_file_id", "")
             if not prompt:
-                return mcp_jsonrpc_error(req_id, -32602, "Le paramètre 'prompt' est requis"), session_id
+                return mcp_jsonrpc_error(req_id, -32602, "Le paramètre 'prompt' est requis")
             if not source_file_id:
-                return mcp_jsonrpc_error(req_id, -32602, "Le paramètre 'source_file_id' est requis"), session_id
+                return mcp_jsonrpc_error(req_id, -32602, "Le paramètre 'source_file_id' est requis")
 
             try:
                 pptx_bytes, original_filename = await download_from_siagpt_medias(source_file_id, LLM_API_KEY)
-                result = await _do_edit(pptx_bytes, prompt, LLM_API_KEY)
+                async with _TOOL_SEM:
+                    result = await _do_edit(pptx_bytes, prompt, LLM_API_KEY)
                 summary = _format_mcp_summary("modifiée", result, f"Source : {original_filename} ({source_file_id})")
                 return mcp_jsonrpc_response(req_id, {
                     "content": [{"type": "text", "text": summary}]
-                }), session_id
+                })
             except httpx.HTTPStatusError as e:
-                return mcp_jsonrpc_error(req_id, -32000, f"Fichier {source_file_id} introuvable : {e.response.status_code}"), session_id
+                return mcp_jsonrpc_error(req_id, -32000, f"Fichier {source_file_id} introuvable : {e.response.status_code}")
             except Exception as e:
-                return mcp_jsonrpc_error(req_id, -32000, str(e)), session_id
+                return mcp_jsonrpc_error(req_id, -32000, str(e))
 
-        return mcp_jsonrpc_error(req_id, -32601, f"Tool inconnu : {tool_name}"), session_id
-
-    return mcp_jsonrpc_error(req_id, -32601, f"Méthode inconnue : {method}"), session_id
+        case _:
+            return mcp_jsonrpc_error(req_id, -32601, f"Tool inconnu : {tool_name}")
 
 
 @app.post("/mcp/sse")
@@ -939,7 +1141,11 @@ async def mcp_messages(request: Request, session_id: str = ""):
     body = await request.json()
     response, _ = await handle_mcp_request(body, session_id)
     if response is not None:
-        await queue.put(response)
+        try:
+            queue.put_nowait(response)
+        except asyncio.QueueFull:
+            # Le client ne consomme plus son stream SSE → on abandonne le message
+            logger.warning(f"Queue MCP pleine pour la session {session_id} — message ignoré")
     return JSONResponse({"status": "ok"})
 
 
@@ -10,19 +10,63 @@ Fonctions extraites et adaptées du skill PPTX d'Anthropic :
 La validation est dans pptx_validate.py (module séparé).
 """
 
+import hashlib
 import io
+import os
+import posixpath
 import re
 import shutil
 import tempfile
 import zipfile
 from pathlib import Path
+from typing import BinaryIO
 
 import logging
 
 import defusedxml.minidom
+import lxml.etree
 
 logger = logging.getLogger(__name__)
 
+# Parser lxml sans résolution d'entités ni accès réseau (protection XXE)
+_XML_PARSER = lxml.etree.XMLParser(resolve_entities=False, no_network=True)
+
+PKG_RELS_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+CONTENT_TYPES_NS = "http://schemas.openxmlformats.org/package/2006/content-types"
+OFFICE_RELS_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PML_NS = "http://schemas.openxmlformats.org/presentationml/2006/main"
+
+_REL_TAG = f"{{{PKG_RELS_NS}}}Relationship"
+_OVERRIDE_TAG = f"{{{CONTENT_TYPES_NS}}}Override"
+_SLDID_TAG = f"{{{PML_NS}}}sldId"
+_SLDIDLST_TAG = f"{{{PML_NS}}}sldIdLst"
+_RID_ATTR = f"{{{OFFICE_RELS_NS}}}id"
+
+# Relations de presentation.xml.rels qui pointent vers une slide
+_SLIDE_RELS_XPATH = lxml.etree.XPath(
+    "/r:Relationships/r:Relationship[starts-with(@Target, 'slides/')]",
+    namespaces={"r": PKG_RELS_NS},
+)
+
+
+def _parse_xml(path: Path) -> lxml.etree._ElementTree:
+    """Parse un fichier XML avec le parser lxml sécurisé du module."""
+    return lxml.etree.parse(str(path), _XML_PARSER)
+
+
+def _write_xml(tree: lxml.etree._ElementTree, path: Path) -> None:
+    """
+    Réécrit un arbre lxml sur disque (déclaration XML standalone, UTF-8).
+    Écriture atomique : fichier temporaire dans le même dossier, puis os.replace.
+    """
+    tmp_path = f"{path}.tmp"
+    try:
+        tree.write(tmp_path, xml_declaration=True, encoding="UTF-8", standalone=True)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
 
 # ============================================================
 # Smart Quotes — escape/unescape
@@ -37,14 +81,23 @@ SMART_QUOTE_REPLACEMENTS = {
 
 SMART_QUOTE_RESTORE = {v: k for k, v in SMART_QUOTE_REPLACEMENTS.items()}
 
+# Compilés une fois à l'import : une seule passe par fichier au lieu d'un replace par entrée
+_ESCAPE_TRANS = str.maketrans(SMART_QUOTE_REPLACEMENTS)
+_RESTORE_RE = re.compile("|".join(map(re.escape, SMART_QUOTE_RESTORE)))
+
+# Niveau de compression deflate pour le repack.
+# Le XML OOXML condensé compresse quasiment aussi bien au niveau 1 qu'au niveau 6
+# (défaut zlib), pour un coût CPU 3 à 5× moindre.
+FAST_COMPRESSLEVEL = 1
+
 
 # ============================================================
 # UNPACK — Décompresse un PPTX avec pretty-print XML
 # ============================================================
 
-def unpack(pptx_bytes: bytes, output_dir: str) -> str:
+def unpack(pptx_bytes: bytes | BinaryIO, output_dir: str) -> str:
     """
-    Décompresse un PPTX en mémoire vers output_dir.
+    Décompresse un PPTX (bytes ou fichier ouvert) vers output_dir.
     - Pretty-print les fichiers XML pour lisibilité
     - Escape les smart quotes pour éviter les problèmes d'encodage
 
@@ -53,7 +106,8 @@ def unpack(pptx_bytes: bytes, output_dir: str) -> str:
     output_path = Path(output_dir)
     output_path.mkdir(parents=True, exist_ok=True)
 
-    with zipfile.ZipFile(io.BytesIO(pptx_bytes), "r") as zf:
+    source = io.BytesIO(pptx_bytes) if isinstance(pptx_bytes, (bytes, bytearray)) else pptx_bytes
+    with zipfile.ZipFile(source, "r") as zf:
         zf.extractall(output_path)
 
     # Pretty-print tous les XML
@@ -82,9 +136,7 @@ def _escape_smart_quotes(xml_file: Path) -> None:
     """Remplace les smart quotes par des entités XML."""
     try:
         content = xml_file.read_text(encoding="utf-8")
-        for char, entity in SMART_QUOTE_REPLACEMENTS.items():
-            content = content.replace(char, entity)
-        xml_file.write_text(content, encoding="utf-8")
+        xml_file.write_text(content.translate(_ESCAPE_TRANS), encoding="utf-8")
     except Exception:
         logger.debug("Skipping smart quote escape for: %s", xml_file.name)
 
@@ -93,19 +145,36 @@ def _escape_smart_quotes(xml_file: Path) -> None:
 # PACK — Repackage un dossier en PPTX
 # ============================================================
 
-def pack(unpacked_dir: str, original_bytes: bytes = None) -> bytes:
+def pack(
+    unpacked_dir: str,
+    original_bytes: bytes = None,
+    fast: bool = True,
+    output_path: Path | None = None,
+) -> bytes | None:
     """
     Repackage un dossier décompressé en PPTX.
     - Restore les smart quotes en vrais caractères unicode
     - Condense le XML (supprime whitespace inutile sauf dans les <a:t>)
     - Retourne les bytes du fichier PPTX.
+
+    fast=True (défaut) compresse au niveau FAST_COMPRESSLEVEL ;
+    fast=False utilise le niveau zlib par défaut (fichier un peu plus petit, plus lent).
+
+    Si output_path est fourni, le ZIP est écrit directement dans ce fichier
+    (pas de buffer en mémoire) et la fonction retourne None.
     """
+    compresslevel = FAST_COMPRESSLEVEL if fast else None
     input_dir = Path(unpacked_dir)
 
     with tempfile.TemporaryDirectory() as temp_dir:
         temp_content_dir = Path(temp_dir) / "content"
         shutil.copytree(input_dir, temp_content_dir)
 
+        # Une seule copie physique par image (les slides dupliquées partagent le media)
+        deduped = _dedupe_media(temp_content_dir)
+        if deduped:
+            logger.info("Media dédupliqués : %d fichier(s) retiré(s)", len(deduped))
+
         # Restaurer les smart quotes puis condenser le XML
         for pattern in ["*.xml", "*.rels"]:
             for xml_file in temp_content_dir.rglob(pattern):
@@ -113,21 +182,103 @@ def pack(unpacked_dir: str, original_bytes: bytes = None) -> bytes:
                 _condense_xml(xml_file)
 
         # Créer le ZIP
-        buf = io.BytesIO()
-        with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+        buf = io.BytesIO() if output_path is None else None
+        with zipfile.ZipFile(buf or output_path, "w", zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as zf:
             for f in sorted(temp_content_dir.rglob("*")):
                 if f.is_file():
                     zf.write(f, f.relative_to(temp_content_dir))
 
-        return buf.getvalue()
+        return buf.getvalue() if buf is not None else None
+
+
+def _dedupe_media(content_dir: Path) -> list[str]:
+    """
+    Déduplique ppt/media/ par empreinte SHA-256.
+    Pour chaque groupe de fichiers identiques, garde le premier (ordre alphabétique),
+    redirige les Target des .rels vers lui, supprime les copies et leurs
+    éventuels <Override> dans [Content_Types].xml.
+
+    Retourne la liste des fichiers supprimés (chemins relatifs, ex: "ppt/media/image3.png") ;
+    vide, sans rien modifier, si un .rels ne peut pas être parsé.
+    """
+    media_dir = content_dir / "ppt" / "media"
+    if not media_dir.is_dir():
+        return []
+
+    # Empreinte → nom conservé ; fichier dupliqué → nom conservé
+    kept_by_digest = {}
+    replacements = {}
+    for media_file in sorted(media_dir.iterdir()):
+        if not media_file.is_file():
+            continue
+        with open(media_file, "rb") as f:
+            digest = hashlib.file_digest(f, "sha256").hexdigest()
+        if digest in kept_by_digest:
+            replacements[f"ppt/media/{media_file.name}"] = kept_by_digest[digest]
+        else:
+            kept_by_digest[digest] = media_file.name
+
+    if not replacements:
+        return []
+
+    # Tous les .rels sont parsés avant toute modification : un .rels illisible
+    # pourrait référencer une copie, on ne déduplique alors rien
+    rels_trees = []
+    for rels_file in content_dir.rglob("*.rels"):
+        try:
+            rels_trees.append((rels_file, _parse_xml(rels_file)))
+        except lxml.etree.XMLSyntaxError:
+            logger.debug("Skipping media dedupe, unparsable rels: %s", rels_file.name)
+            return []
+
+    # Rediriger les relations vers la copie conservée
+    for rels_file, tree in rels_trees:
+        if rels_file.parent.parent == content_dir:
+            owner_dir = ""  # _rels/.rels → relatif à la racine du package
+        else:
+            owner_dir = rels_file.parent.parent.relative_to(content_dir).as_posix()
+
+        changed = False
+        for rel in tree.getroot().iter(_REL_TAG):
+            target = rel.get("Target", "")
+            if not target or rel.get("TargetMode") == "External":
+                continue
+            if target.startswith("/"):
+                part = posixpath.normpath(target.lstrip("/"))
+            else:
+                part = posixpath.normpath(posixpath.join(owner_dir, target))
+            if part in replacements:
+                rel.set("Target", posixpath.join(posixpath.dirname(target), replacements[part]))
+                changed = True
+
+        if changed:
+            _write_xml(tree, rels_file)
+
+    for part in replacements:
+        (content_dir / part).unlink()
+
+    # Retirer les éventuels Override des fichiers supprimés
+    ct_path = content_dir / "[Content_Types].xml"
+    if ct_path.exists():
+        tree = _parse_xml(ct_path)
+        removed_parts = {f"/{part}" for part in replacements}
+        overrides = [
+            o for o in tree.getroot().iter(_OVERRIDE_TAG)
+            if o.get("PartName") in removed_parts
+        ]
+        for override in overrides:
+            override.getparent().remove(override)
+        if overrides:
+            _write_xml(tree, ct_path)
+
+    return list(replacements)
 
 
 def _restore_smart_quotes(xml_file: Path) -> None:
     """Restaure les entités smart quotes en vrais caractères unicode."""
     try:
         content = xml_file.read_text(encoding="utf-8")
-        for entity, char in SMART_QUOTE_RESTORE.items():
-            content = content.replace(entity, char)
+        content = _RESTORE_RE.sub(lambda m: SMART_QUOTE_RESTORE[m.group(0)], content)
         xml_file.write_text(content, encoding="utf-8")
     except Exception:
         logger.debug("Skipping smart quote restore for: %s", xml_file.name)
@@ -171,7 +322,8 @@ def clean(unpacked_dir: str) -> list[str]:
     - Fichiers media/embeddings/charts non référencés
     - Met à jour [Content_Types].xml
 
-    Retourne la liste des fichiers supprimés.
+    Retourne la liste des fichiers supprimés (chemins relatifs en "/",
+    ex: "ppt/media/image3.png").
     """
     path = Path(unpacked_dir)
     all_removed = []
@@ -185,15 +337,30 @@ def clean(unpacked_dir: str) -> list[str]:
     all_removed.extend(trash_removed)
 
     # 3. Fichiers non référencés (boucle jusqu'à stabilisation)
+    # Les cibles de chaque .rels sont mises en cache d'un tour à l'autre :
+    # seuls les fichiers modifiés (mtime) sont re-parsés.
+    # Le chemin résolu est calculé une seule fois (resolve() fait un realpath).
+    # L'ensemble des fichiers référencés ne peut changer que si un .rels a été
+    # supprimé : sinon on réutilise celui du tour précédent.
+    base_resolved = path.resolve()
+    rels_cache = {}
+    referenced = None
+    rels_removed = True
     while True:
-        removed_rels = _remove_orphaned_rels_files(path)
-        referenced = _get_referenced_files(path)
+        removed_rels = _remove_orphaned_rels_files(path, rels_cache, base_resolved)
+        if rels_removed or removed_rels:
+            referenced = _get_referenced_files(path, rels_cache, base_resolved)
         removed_files = _remove_orphaned_files(path, referenced)
 
         total_removed = removed_rels + removed_files
         if not total_removed:
             break
         all_removed.extend(total_removed)
+        for removed_path in total_removed:
+            if removed_path.endswith(".rels"):
+                rels_cache.pop(os.path.normpath(os.path.join(base_resolved, removed_path)), None)
+        # Les .rels de removed_rels sont déjà pris en compte dans referenced
+        rels_removed = any(p.endswith(".rels") for p in removed_files)
 
     # 4. Mettre à jour Content_Types
     if all_removed:
@@ -202,25 +369,31 @@ def clean(unpacked_dir: str) -> list[str]:
     return all_removed
 
 
-def _get_slides_in_sldidlst(unpacked_dir: Path) -> set[str]:
-    """Retourne les noms de fichiers slides référencés dans presentation.xml."""
+def _get_slides_in_sldidlst(
+    unpacked_dir: Path, pres_rels_tree: lxml.etree._ElementTree = None
+) -> set[str]:
+    """
+    Retourne les noms de fichiers slides référencés dans presentation.xml.
+    pres_rels_tree : presentation.xml.rels déjà parsé (évite un second parse).
+    """
     pres_path = unpacked_dir / "ppt" / "presentation.xml"
     pres_rels_path = unpacked_dir / "ppt" / "_rels" / "presentation.xml.rels"
 
     if not pres_path.exists() or not pres_rels_path.exists():
         return set()
 
-    rels_dom = defusedxml.minidom.parse(str(pres_rels_path))
+    if pres_rels_tree is None:
+        pres_rels_tree = _parse_xml(pres_rels_path)
+
     rid_to_slide = {}
-    for rel in rels_dom.getElementsByTagName("Relationship"):
-        rid = rel.getAttribute("Id")
-        target = rel.getAttribute("Target")
-        rel_type = rel.getAttribute("Type")
-        if "slide" in rel_type and target.startswith("slides/"):
-            rid_to_slide[rid] = target.replace("slides/", "")
+    for rel in pres_rels_tree.getroot().iter(_REL_TAG):
+        target = rel.get("Target", "")
+        if "slide" in rel.get("Type", "") and target.startswith("slides/"):
+            rid_to_slide[rel.get("Id", "")] = target.replace("slides/", "")
 
-    pres_content = pres_path.read_text(encoding="utf-8")
-    referenced_rids = set(re.findall(r'<p:sldId[^>]*r:id="([^"]+)"', pres_content))
+    referenced_rids = {
+        sld_id.get(_RID_ATTR) for sld_id in _parse_xml(pres_path).getroot().iter(_SLDID_TAG)
+    }
 
     return {rid_to_slide[rid] for rid in referenced_rids if rid in rid_to_slide}
 
@@ -234,37 +407,38 @@ def _remove_orphaned_slides(unpacked_dir: Path) -> list[str]:
     if not slides_dir.exists():
         return []
 
-    referenced_slides = _get_slides_in_sldidlst(unpacked_dir)
+    # presentation.xml.rels est parsé une seule fois : lecture des slides
+    # référencées, puis nettoyage éventuel sur le même arbre
+    pres_rels_tree = _parse_xml(pres_rels_path) if pres_rels_path.exists() else None
+    referenced_slides = _get_slides_in_sldidlst(unpacked_dir, pres_rels_tree)
     removed = []
 
-    for slide_file in slides_dir.glob("slide*.xml"):
-        if slide_file.name not in referenced_slides:
-            rel_path = slide_file.relative_to(unpacked_dir)
-            slide_file.unlink()
-            removed.append(str(rel_path))
-
-            rels_file = slides_rels_dir / f"{slide_file.name}.rels"
-            if rels_file.exists():
-                rels_file.unlink()
-                removed.append(str(rels_file.relative_to(unpacked_dir)))
-
-    # Nettoyer presentation.xml.rels
-    if removed and pres_rels_path.exists():
-        rels_dom = defusedxml.minidom.parse(str(pres_rels_path))
-        changed = False
-
-        for rel in list(rels_dom.getElementsByTagName("Relationship")):
-            target = rel.getAttribute("Target")
-            if target.startswith("slides/"):
-                slide_name = target.replace("slides/", "")
-                if slide_name not in referenced_slides:
-                    if rel.parentNode:
-                        rel.parentNode.removeChild(rel)
-                        changed = True
-
-        if changed:
-            with open(pres_rels_path, "wb") as f:
-                f.write(rels_dom.toxml(encoding="utf-8"))
+    with os.scandir(slides_dir) as it:
+        orphans = {
+            entry.name for entry in it
+            if entry.name.startswith("slide") and entry.name.endswith(".xml")
+            and entry.is_file(follow_symlinks=False)
+        } - referenced_slides
+
+    for name in orphans:
+        os.unlink(os.path.join(slides_dir, name))
+        removed.append(f"ppt/slides/{name}")
+
+        rels_file = os.path.join(slides_rels_dir, f"{name}.rels")
+        if os.path.exists(rels_file):
+            os.unlink(rels_file)
+            removed.append(f"ppt/slides/_rels/{name}.rels")
+
+    # Nettoyer presentation.xml.rels (rien à faire si aucune slide supprimée)
+    if orphans and pres_rels_tree is not None:
+        doomed = [
+            rel for rel in _SLIDE_RELS_XPATH(pres_rels_tree)
+            if rel.get("Target")[len("slides/"):] not in referenced_slides
+        ]
+        if doomed:
+            for rel in doomed:
+                rel.getparent().remove(rel)
+            _write_xml(pres_rels_tree, pres_rels_path)
 
     return removed
 
@@ -274,161 +448,250 @@ def _remove_trash_directory(unpacked_dir: Path) -> list[str]:
     trash_dir = unpacked_dir / "[trash]"
     removed = []
 
-    if trash_dir.exists() and trash_dir.is_dir():
-        for file_path in trash_dir.iterdir():
-            if file_path.is_file():
-                removed.append(str(file_path.relative_to(unpacked_dir)))
-                file_path.unlink()
-        trash_dir.rmdir()
+    if trash_dir.is_dir():
+        with os.scandir(trash_dir) as it:
+            removed = [f"[trash]/{e.name}" for e in it if e.is_file(follow_symlinks=False)]
+        shutil.rmtree(trash_dir)
 
     return removed
 
 
-def _get_slide_referenced_files(unpacked_dir: Path) -> set:
+def _iter_rels_paths(root: str):
+    """
+    Parcourt root récursivement et yield le chemin (str) de chaque fichier .rels.
+    os.scandir avec une pile explicite : pas d'objet Path créé par entrée.
+    """
+    stack = [root]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.endswith(".rels") and entry.is_file(follow_symlinks=False):
+                        yield entry.path
+        except FileNotFoundError:
+            continue
+
+
+def _rels_targets(rels_path: str, base_resolved: Path, rels_cache: dict = None) -> frozenset:
+    """
+    Retourne les cibles d'un fichier .rels, sous forme de chemins texte relatifs
+    à base_resolved avec des "/" (ex: "ppt/media/image1.png").
+    rels_path doit être situé sous base_resolved (le dossier décompressé, résolu).
+
+    Si rels_cache est fourni ({chemin: (mtime_ns, cibles)}), le résultat y est
+    mémorisé et réutilisé tant que le fichier n'a pas été modifié.
+    """
+    mtime = os.stat(rels_path).st_mtime_ns
+    if rels_cache is not None:
+        cached = rels_cache.get(rels_path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+    # Normalisation purement textuelle (pas de resolve() → zéro appel système) :
+    # les cibles sont relatives au dossier parent de _rels/
+    prefix = str(base_resolved) + os.sep
+    source_dir = os.path.dirname(os.path.dirname(rels_path))
+    targets = set()
+    for rel in _parse_xml(rels_path).getroot().iter(_REL_TAG):
+        target = rel.get("Target")
+        if not target:
+            continue
+        target_path = os.path.normpath(os.path.join(source_dir, target))
+        if target_path.startswith(prefix):
+            targets.add(target_path[len(prefix):].replace(os.sep, "/"))
+
+    targets = frozenset(targets)
+    if rels_cache is not None:
+        rels_cache[rels_path] = (mtime, targets)
+    return targets
+
+
+def _get_slide_referenced_files(
+    unpacked_dir: Path, rels_cache: dict = None, base_resolved: Path = None
+) -> set[str]:
     """Retourne l'ensemble des fichiers référencés par les slides."""
+    if base_resolved is None:
+        base_resolved = unpacked_dir.resolve()
     referenced = set()
-    slides_rels_dir = unpacked_dir / "ppt" / "slides" / "_rels"
+    slides_rels_dir = base_resolved / "ppt" / "slides" / "_rels"
 
     if not slides_rels_dir.exists():
         return referenced
 
-    for rels_file in slides_rels_dir.glob("*.rels"):
-        dom = defusedxml.minidom.parse(str(rels_file))
-        for rel in dom.getElementsByTagName("Relationship"):
-            target = rel.getAttribute("Target")
-            if not target:
-                continue
-            target_path = (rels_file.parent.parent / target).resolve()
-            try:
-                referenced.add(target_path.relative_to(unpacked_dir.resolve()))
-            except ValueError:
-                pass
+    for rels_path in _iter_rels_paths(str(slides_rels_dir)):
+        referenced |= _rels_targets(rels_path, base_resolved, rels_cache)
 
     return referenced
 
 
-def _remove_orphaned_rels_files(unpacked_dir: Path) -> list[str]:
+def _remove_orphaned_rels_files(
+    unpacked_dir: Path, rels_cache: dict = None, base_resolved: Path = None
+) -> list[str]:
     """Supprime les fichiers .rels orphelins."""
     resource_dirs = ["charts", "diagrams", "drawings"]
     removed = []
-    slide_referenced = _get_slide_referenced_files(unpacked_dir)
+    slide_referenced = _get_slide_referenced_files(unpacked_dir, rels_cache, base_resolved)
 
     for dir_name in resource_dirs:
-        rels_dir = unpacked_dir / "ppt" / dir_name / "_rels"
-        if not rels_dir.exists():
-            continue
+        resource_dir = os.path.join(unpacked_dir, "ppt", dir_name)
 
-        for rels_file in rels_dir.glob("*.rels"):
-            resource_file = rels_dir.parent / rels_file.name.replace(".rels", "")
-            try:
-                resource_rel_path = resource_file.resolve().relative_to(unpacked_dir.resolve())
-            except ValueError:
+        for entry in _scan_files(os.path.join(resource_dir, "_rels")):
+            if not entry.name.endswith(".rels"):
                 continue
+            resource_name = entry.name[:-len(".rels")]
+            resource_rel_path = f"ppt/{dir_name}/{resource_name}"
 
-            if not resource_file.exists() or resource_rel_path not in slide_referenced:
-                rels_file.unlink()
-                removed.append(str(rels_file.relative_to(unpacked_dir)))
+            if (resource_rel_path not in slide_referenced
+                    or not os.path.exists(os.path.join(resource_dir, resource_name))):
+                os.unlink(entry.path)
+                removed.append(f"ppt/{dir_name}/_rels/{entry.name}")
 
     return removed
 
 
-def _get_referenced_files(unpacked_dir: Path) -> set:
+def _get_referenced_files(
+    unpacked_dir: Path, rels_cache: dict = None, base_resolved: Path = None
+) -> set[str]:
     """Retourne l'ensemble de tous les fichiers référencés dans les .rels."""
+    if base_resolved is None:
+        base_resolved = unpacked_dir.resolve()
     referenced = set()
 
-    for rels_file in unpacked_dir.rglob("*.rels"):
-        dom = defusedxml.minidom.parse(str(rels_file))
-        for rel in dom.getElementsByTagName("Relationship"):
-            target = rel.getAttribute("Target")
-            if not target:
-                continue
-            target_path = (rels_file.parent.parent / target).resolve()
-            try:
-                referenced.add(target_path.relative_to(unpacked_dir.resolve()))
-            except ValueError:
-                pass
+    for rels_path in _iter_rels_paths(str(base_resolved)):
+        referenced |= _rels_targets(rels_path, base_resolved, rels_cache)
 
     return referenced
 
 
-def _remove_orphaned_files(unpacked_dir: Path, referenced: set) -> list[str]:
-    """Supprime les fichiers media/embeddings/etc non référencés."""
+def _remove_orphaned_files(unpacked_dir: Path, referenced: set[str]) -> list[str]:
+    """
+    Supprime les fichiers media/embeddings/etc non référencés.
+    referenced contient des chemins texte en "/" (cf. _rels_targets) ; les
+    chemins relatifs sont construits par simple concaténation ("ppt/<dossier>/").
+    """
     resource_dirs = ["media", "embeddings", "charts", "diagrams", "tags", "drawings", "ink"]
     removed = []
+    ppt_dir = os.path.join(unpacked_dir, "ppt")
 
     for dir_name in resource_dirs:
-        dir_path = unpacked_dir / "ppt" / dir_name
-        if not dir_path.exists():
-            continue
-
-        for file_path in dir_path.glob("*"):
-            if not file_path.is_file():
-                continue
-            rel_path = file_path.relative_to(unpacked_dir)
+        rel_prefix = f"ppt/{dir_name}/"
+        for entry in _scan_files(os.path.join(ppt_dir, dir_name)):
+            rel_path = rel_prefix + entry.name
             if rel_path not in referenced:
-                file_path.unlink()
-                removed.append(str(rel_path))
+                os.unlink(entry.path)
+                removed.append(rel_path)
 
     # Themes orphelins
-    theme_dir = unpacked_dir / "ppt" / "theme"
-    if theme_dir.exists():
-        for file_path in theme_dir.glob("theme*.xml"):
-            rel_path = file_path.relative_to(unpacked_dir)
-            if rel_path not in referenced:
-                file_path.unlink()
-                removed.append(str(rel_path))
-                theme_rels = theme_dir / "_rels" / f"{file_path.name}.rels"
-                if theme_rels.exists():
-                    theme_rels.unlink()
-                    removed.append(str(theme_rels.relative_to(unpacked_dir)))
+    theme_dir = os.path.join(ppt_dir, "theme")
+    for entry in _scan_files(theme_dir):
+        if not (entry.name.startswith("theme") and entry.name.endswith(".xml")):
+            continue
+        rel_path = "ppt/theme/" + entry.name
+        if rel_path not in referenced:
+            os.unlink(entry.path)
+            removed.append(rel_path)
+            theme_rels = os.path.join(theme_dir, "_rels", f"{entry.name}.rels")
+            if os.path.exists(theme_rels):
+                os.unlink(theme_rels)
+                removed.append(f"ppt/theme/_rels/{entry.name}.rels")
 
     # Notes slides orphelines
-    notes_dir = unpacked_dir / "ppt" / "notesSlides"
-    if notes_dir.exists():
-        for file_path in notes_dir.glob("*.xml"):
-            if not file_path.is_file():
-                continue
-            rel_path = file_path.relative_to(unpacked_dir)
-            if rel_path not in referenced:
-                file_path.unlink()
-                removed.append(str(rel_path))
+    notes_dir = os.path.join(ppt_dir, "notesSlides")
+    for entry in _scan_files(notes_dir):
+        if not entry.name.endswith(".xml"):
+            continue
+        rel_path = "ppt/notesSlides/" + entry.name
+        if rel_path not in referenced:
+            os.unlink(entry.path)
+            removed.append(rel_path)
 
-        notes_rels_dir = notes_dir / "_rels"
-        if notes_rels_dir.exists():
-            for file_path in notes_rels_dir.glob("*.rels"):
-                notes_file = notes_dir / file_path.name.replace(".rels", "")
-                if not notes_file.exists():
-                    file_path.unlink()
-                    removed.append(str(file_path.relative_to(unpacked_dir)))
+    for entry in _scan_files(os.path.join(notes_dir, "_rels")):
+        if not entry.name.endswith(".rels"):
+            continue
+        if not os.path.exists(os.path.join(notes_dir, entry.name[:-len(".rels")])):
+            os.unlink(entry.path)
+            removed.append(f"ppt/notesSlides/_rels/{entry.name}")
 
     return removed
 
 
+def _scan_files(dir_path: str) -> list[os.DirEntry]:
+    """Liste les fichiers (pas les dossiers) de dir_path ; [] s'il n'existe pas."""
+    try:
+        with os.scandir(dir_path) as it:
+            return [entry for entry in it if entry.is_file(follow_symlinks=False)]
+    except FileNotFoundError:
+        return []
+
+
 def _update_content_types(unpacked_dir: Path, removed_files: list[str]) -> None:
-    """Met à jour [Content_Types].xml après suppression de fichiers."""
+    """
+    Met à jour [Content_Types].xml après suppression de fichiers.
+
+    Le fichier est relu en flux (iterparse) et réécrit au fil de l'eau dans
+    un fichier temporaire, sans les Override des parts supprimées, puis
+    remplacé atomiquement.
+    """
     ct_path = unpacked_dir / "[Content_Types].xml"
-    if not ct_path.exists():
+    if not ct_path.exists() or not removed_files:
         return
 
-    dom = defusedxml.minidom.parse(str(ct_path))
+    removed_set = {"/" + p.replace(os.sep, "/") for p in removed_files}
+    tmp_path = ct_path.with_name(ct_path.name + ".tmp")
     changed = False
 
-    for override in list(dom.getElementsByTagName("Override")):
-        part_name = override.getAttribute("PartName").lstrip("/")
-        if part_name in removed_files:
-            if override.parentNode:
-                override.parentNode.removeChild(override)
-                changed = True
+    try:
+        with lxml.etree.xmlfile(str(tmp_path), encoding="UTF-8") as xf:
+            xf.write_declaration(standalone=True)
+            events = lxml.etree.iterparse(
+                str(ct_path), events=("start", "end"),
+                resolve_entities=False, no_network=True,
+            )
+            # Premier événement = ouverture de <Types> : tag, attributs et nsmap
+            _, root = next(events)
+            with xf.element(root.tag, dict(root.attrib), nsmap=root.nsmap):
+                for event, elem in events:
+                    # Enfants directs de <Types> complets : Default ou Override
+                    if event != "end" or elem.getparent() is not root:
+                        continue
+                    if elem.tag == _OVERRIDE_TAG and elem.get("PartName") in removed_set:
+                        changed = True
+                    else:
+                        elem.tail = None  # indentation d'origine non reproduite
+                        xf.write(elem)
+                    elem.clear()
+                    root.remove(elem)
 
-    if changed:
-        with open(ct_path, "wb") as f:
-            f.write(dom.toxml(encoding="utf-8"))
+        if changed:
+            os.replace(tmp_path, ct_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
 
 
 # ============================================================
 # DUPLICATE SLIDE — Duplique une slide avec ses relations
 # ============================================================
 
+SLIDE_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.presentationml.slide+xml"
+SLIDE_REL_TYPE = f"{OFFICE_RELS_NS}/slide"
+
+
+def _max_slide_number(slides_dir: Path) -> int:
+    """Plus grand N parmi les fichiers slideN.xml de slides_dir (0 si aucun)."""
+    highest = 0
+    with os.scandir(slides_dir) as it:
+        for entry in it:
+            name = entry.name
+            if name.startswith("slide") and name.endswith(".xml"):
+                digits = name[5:-4]
+                if digits.isascii() and digits.isdigit():
+                    highest = max(highest, int(digits))
+    return highest
+
+
 def duplicate_slide(unpacked_dir: str, source_filename: str) -> dict:
     """
     Duplique une slide existante.
@@ -441,107 +704,154 @@ def duplicate_slide(unpacked_dir: str, source_filename: str) -> dict:
     - new_sld_id: id pour <p:sldId>
     - new_r_id: rId pour la relation
     """
+    return duplicate_slides(unpacked_dir, [source_filename])[0]
+
+
+def duplicate_slides(unpacked_dir: str, sources: list[str]) -> list[dict]:
+    """
+    Duplique plusieurs slides en une passe (cf. duplicate_slide).
+
+    [Content_Types].xml, presentation.xml.rels et presentation.xml ne sont
+    parsés qu'une fois ; les numéros de slide, rId et sldId sont incrémentés
+    en mémoire, et les deux premiers fichiers sont réécrits une seule fois.
+    presentation.xml n'est pas modifié : les sldId retournés sont à passer
+    à add_slide_to_presentation().
+
+    Retourne un dict par source, dans l'ordre de sources.
+    """
     path = Path(unpacked_dir)
     slides_dir = path / "ppt" / "slides"
     rels_dir = slides_dir / "_rels"
 
-    source_slide = slides_dir / source_filename
-    if not source_slide.exists():
-        raise FileNotFoundError(f"Slide source {source_filename} introuvable")
-
-    # Trouver le prochain numéro
-    existing = [int(m.group(1)) for f in slides_dir.glob("slide*.xml")
-                if (m := re.match(r"slide(\d+)\.xml", f.name))]
-    next_num = max(existing) + 1 if existing else 1
-    dest = f"slide{next_num}.xml"
-    dest_slide = slides_dir / dest
-
-    # Copier la slide
-    shutil.copy2(source_slide, dest_slide)
-
-    # Copier les rels (sans notesSlide)
-    source_rels = rels_dir / f"{source_filename}.rels"
-    dest_rels = rels_dir / f"{dest}.rels"
-
-    if source_rels.exists():
-        shutil.copy2(source_rels, dest_rels)
-        # Retirer les références aux notesSlide pour éviter les doublons
-        rels_content = dest_rels.read_text(encoding="utf-8")
-        rels_content = re.sub(
-            r'\s*<Relationship[^>]*Type="[^"]*notesSlide"[^>]*/>\s*',
-            "\n",
-            rels_content,
-        )
-        dest_rels.write_text(rels_content, encoding="utf-8")
-
-    # Mettre à jour [Content_Types].xml
-    ct_path = path / "[Content_Types].xml"
-    ct_content = ct_path.read_text(encoding="utf-8")
-    if f"/ppt/slides/{dest}" not in ct_content:
-        new_override = f'<Override PartName="/ppt/slides/{dest}" ContentType="application/vnd.openxmlformats-officedocument.presentationml.slide+xml"/>'
-        ct_content = ct_content.replace("</Types>", f"  {new_override}\n</Types>")
-        ct_path.write_text(ct_content, encoding="utf-8")
+    for source_filename in sources:
+        if not (slides_dir / source_filename).exists():
+            raise FileNotFoundError(f"Slide source {source_filename} introuvable")
 
-    # Ajouter dans presentation.xml.rels
+    ct_path = path / "[Content_Types].xml"
     pres_rels_path = path / "ppt" / "_rels" / "presentation.xml.rels"
-    pres_rels = pres_rels_path.read_text(encoding="utf-8")
-    rids = [int(m) for m in re.findall(r'Id="rId(\d+)"', pres_rels)]
-    next_rid = max(rids) + 1 if rids else 1
-    rid = f"rId{next_rid}"
-
-    if f"slides/{dest}" not in pres_rels:
-        new_rel = f'<Relationship Id="{rid}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/slide" Target="slides/{dest}"/>'
-        pres_rels = pres_rels.replace("</Relationships>", f"  {new_rel}\n</Relationships>")
-        pres_rels_path.write_text(pres_rels, encoding="utf-8")
-
-    # Trouver le prochain slide ID
-    pres_path = path / "ppt" / "presentation.xml"
-    pres_content = pres_path.read_text(encoding="utf-8")
-    slide_ids = [int(m) for m in re.findall(r'<p:sldId[^>]*id="(\d+)"', pres_content)]
-    new_sld_id = max(slide_ids) + 1 if slide_ids else 256
-
-    return {
-        "new_filename": dest,
-        "new_sld_id": new_sld_id,
-        "new_r_id": rid,
-    }
+    ct_tree = _parse_xml(ct_path)
+    pres_rels_tree = _parse_xml(pres_rels_path)
+    pres_root = _load_presentation_tree(unpacked_dir).getroot()
 
+    # Prochains numéros disponibles
+    next_num = _max_slide_number(slides_dir) + 1
 
-def add_slide_to_presentation(unpacked_dir: str, sld_id: int, r_id: str, position: int = None) -> None:
+    rids = [int(m.group(1)) for rel in pres_rels_tree.getroot().iter(_REL_TAG)
+            if (m := re.fullmatch(r"rId(\d+)", rel.get("Id", "")))]
+    next_rid = max(rids) + 1 if rids else 1
+
+    slide_ids = [int(sld.get("id")) for sld in pres_root.iter(_SLDID_TAG)
+                 if sld.get("id", "").isdigit()]
+    next_sld_id = max(slide_ids) + 1 if slide_ids else 256
+
+    ct_parts = {o.get("PartName") for o in ct_tree.getroot().iter(_OVERRIDE_TAG)}
+    rel_targets = {rel.get("Target") for rel in pres_rels_tree.getroot().iter(_REL_TAG)}
+
+    results = []
+    for source_filename in sources:
+        dest = f"slide{next_num}.xml"
+        rid = f"rId{next_rid}"
+        next_num += 1
+        next_rid += 1
+
+        # Copier la slide
+        shutil.copy2(slides_dir / source_filename, slides_dir / dest)
+
+        # Copier les rels, sans les références aux notesSlide (évite les doublons)
+        source_rels = rels_dir / f"{source_filename}.rels"
+        if source_rels.exists():
+            rels_tree = _parse_xml(source_rels)
+            for rel in list(rels_tree.getroot().iter(_REL_TAG)):
+                if rel.get("Type", "").endswith("notesSlide"):
+                    rel.getparent().remove(rel)
+            _write_xml(rels_tree, rels_dir / f"{dest}.rels")
+
+        # [Content_Types].xml
+        part_name = f"/ppt/slides/{dest}"
+        if part_name not in ct_parts:
+            lxml.etree.SubElement(
+                ct_tree.getroot(), _OVERRIDE_TAG,
+                {"PartName": part_name, "ContentType": SLIDE_CONTENT_TYPE},
+            )
+            ct_parts.add(part_name)
+
+        # presentation.xml.rels
+        target = f"slides/{dest}"
+        if target not in rel_targets:
+            lxml.etree.SubElement(
+                pres_rels_tree.getroot(), _REL_TAG,
+                {"Id": rid, "Type": SLIDE_REL_TYPE, "Target": target},
+            )
+            rel_targets.add(target)
+
+        results.append({
+            "new_filename": dest,
+            "new_sld_id": next_sld_id,
+            "new_r_id": rid,
+        })
+        next_sld_id += 1
+
+    _write_xml(ct_tree, ct_path)
+    _write_xml(pres_rels_tree, pres_rels_path)
+    return results
+
+
+def _load_presentation_tree(unpacked_dir: str) -> lxml.etree._ElementTree:
+    """Parse ppt/presentation.xml (réutilisable pour des ajouts en lot)."""
+    return _parse_xml(Path(unpacked_dir) / "ppt" / "presentation.xml")
+
+
+def add_slide_to_presentation(
+    unpacked_dir: str,
+    sld_id: int,
+    r_id: str,
+    position: int = None,
+    tree: lxml.etree._ElementTree = None,
+) -> None:
     """
     Ajoute un <p:sldId> dans <p:sldIdLst> de presentation.xml.
     Si position est spécifié (1-based), insère à cette position.
     Sinon, ajoute à la fin.
+
+    Si tree est fourni (cf. _load_presentation_tree), l'arbre est modifié
+    en mémoire et c'est à l'appelant de l'écrire ; sinon presentation.xml
+    est parsé puis réécrit une seule fois.
     """
-    path = Path(unpacked_dir)
-    pres_path = path / "ppt" / "presentation.xml"
-    pres_content = pres_path.read_text(encoding="utf-8")
+    pres_path = Path(unpacked_dir) / "ppt" / "presentation.xml"
+    owns_tree = tree is None
+    if owns_tree:
+        tree = _parse_xml(pres_path)
 
-    new_entry = f'<p:sldId id="{sld_id}" r:id="{r_id}"/>'
+    sld_id_lst = tree.getroot().find(_SLDIDLST_TAG)
+    if sld_id_lst is None:
+        raise ValueError("presentation.xml ne contient pas de <p:sldIdLst>")
 
-    if position is not None:
-        # Extraire les sldId existants, insérer à la bonne position
-        sld_id_pattern = r'(<p:sldId[^/]*/\s*>)'
-        existing_entries = re.findall(sld_id_pattern, pres_content)
+    new_el = lxml.etree.Element(
+        _SLDID_TAG, {"id": str(sld_id), _RID_ATTR: r_id}, nsmap=sld_id_lst.nsmap,
+    )
 
+    if position is not None:
         # Insérer à la position demandée (1-based, clampé)
-        idx = max(0, min(position - 1, len(existing_entries)))
-        existing_entries.insert(idx, new_entry)
-
-        # Reconstruire le bloc <p:sldIdLst>
-        new_block = "<p:sldIdLst>\n    " + "\n    ".join(existing_entries) + "\n  </p:sldIdLst>"
-        pres_content = re.sub(
-            r'<p:sldIdLst>.*?</p:sldIdLst>',
-            new_block,
-            pres_content,
-            flags=re.DOTALL,
-        )
+        idx = max(0, min(position - 1, len(sld_id_lst)))
+        sld_id_lst.insert(idx, new_el)
     else:
         # Ajouter à la fin
-        pres_content = pres_content.replace(
-            "</p:sldIdLst>",
-            f"  {new_entry}\n  </p:sldIdLst>",
-        )
+        sld_id_lst.append(new_el)
+
+    if owns_tree:
+        _write_xml(tree, pres_path)
 
-    pres_path.write_text(pres_content, encoding="utf-8")
+
+def add_slides_to_presentation(
+    unpacked_dir: str, slides: list[tuple[int, str, int | None]]
+) -> None:
+    """
+    Ajoute plusieurs <p:sldId> (sld_id, r_id, position), dans l'ordre de slides,
+    comme des appels successifs à add_slide_to_presentation() :
+    presentation.xml n'est parsé et réécrit qu'une fois.
+    """
+    tree = _load_presentation_tree(unpacked_dir)
+    for sld_id, r_id, position in slides:
+        add_slide_to_presentation(unpacked_dir, sld_id, r_id, position=position, tree=tree)
+    _write_xml(tree, Path(unpacked_dir) / "ppt" / "presentation.xml")
 
@@ -14,14 +14,20 @@ Usage depuis main.py :
     # result = {"valid": True, "repairs": 0, "errors": [], "xsd_errors": []}
 """
 
+import functools
+import hashlib
+import io
+import os
+import posixpath
 import re
-import tempfile
+import threading
 import zipfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import logging
 
-import defusedxml.minidom
 import lxml.etree
 
 logger = logging.getLogger(__name__)
@@ -37,11 +43,53 @@ OFFICE_RELS_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relation
 CONTENT_TYPES_NS = "http://schemas.openxmlformats.org/package/2006/content-types"
 PML_NS = "http://schemas.openxmlformats.org/presentationml/2006/main"
 MC_NS = "http://schemas.openxmlformats.org/markup-compatibility/2006"
+XML_NS = "http://www.w3.org/XML/1998/namespace"
+
+XML_SPACE_ATTR = f"{{{XML_NS}}}space"
+_R_ID_ATTR = f"{{{OFFICE_RELS_NS}}}id"
+MC_IGNORABLE_ATTR = f"{{{MC_NS}}}Ignorable"
+
+# Requêtes compilées une fois (pas de re-parsing de l'expression à chaque fichier)
+_REL_XPATH = lxml.etree.XPath(".//pr:Relationship", namespaces={"pr": PKG_RELS_NS})
+_OVERRIDE_XPATH = lxml.etree.XPath(".//ct:Override", namespaces={"ct": CONTENT_TYPES_NS})
+_SLDLAYOUTID_XPATH = lxml.etree.XPath(".//p:sldLayoutId", namespaces={"p": PML_NS})
+# Relations vers un slideLayout / un notesSlide (prédicat évalué par libxml2)
+_LAYOUT_RELS_XPATH = lxml.etree.XPath(
+    ".//pr:Relationship[contains(@Type, 'slideLayout')]", namespaces={"pr": PKG_RELS_NS}
+)
+_LAYOUT_REL_IDS_XPATH = lxml.etree.XPath(
+    ".//pr:Relationship[contains(@Type, 'slideLayout')]/@Id", namespaces={"pr": PKG_RELS_NS}
+)
+_NOTES_REL_TARGETS_XPATH = lxml.etree.XPath(
+    ".//pr:Relationship[contains(@Type, 'notesSlide')]/@Target", namespaces={"pr": PKG_RELS_NS}
+)
+
+# Éléments dont l'id est vérifié par _check_unique_ids, dans n'importe quel
+# namespace ("{*}") : unicité par fichier, ou sur tout le deck
+_FILE_ID_TAGS = tuple("{*}" + name for name in ("sldId", "sp", "pic", "cxnSp", "grpSp"))
+_GLOBAL_ID_TAGS = ("{*}sldMasterId", "{*}sldLayoutId")
+
+# Parts dont la déclaration dans [Content_Types].xml est vérifiée (nom local du root)
+CT_IMPORTANT_ROOTS = {"sld", "sldLayout", "sldMaster", "presentation", "theme"}
+
+# Options du parser lxml de toutes les lectures de XML du deck :
+# sans résolution d'entités ni accès réseau (protection XXE), et sans
+# table des xml:id (collect_ids) qu'OOXML n'utilise pas
+_SAFE_PARSER_OPTIONS = {"resolve_entities": False, "no_network": True, "collect_ids": False}
+
+# Éléments <*:t> dont le texte commence ou finit par un espace/tab
+# et qui n'ont pas encore xml:space="preserve" (cf. _repair_whitespace)
+_WS_TEXT_XPATH = lxml.etree.XPath(
+    "//*[local-name()='t'][not(@xml:space='preserve')]"
+    "[starts-with(text(), ' ') or starts-with(text(), '\t')"
+    " or substring(text(), string-length(text())) = ' '"
+    " or substring(text(), string-length(text())) = '\t']"
+)
 
 # Namespaces standards OOXML — tout ce qui n'est PAS dans cette liste
 # est considéré comme une extension Microsoft propriétaire et ignoré
 # lors de la validation XSD (car les schemas ISO ne les connaissent pas).
-OOXML_NAMESPACES = {
+OOXML_NAMESPACES = frozenset({
     "http://schemas.openxmlformats.org/officeDocument/2006/math",
     "http://schemas.openxmlformats.org/officeDocument/2006/relationships",
     "http://schemas.openxmlformats.org/schemaLibrary/2006/main",
@@ -57,7 +105,7 @@ OOXML_NAMESPACES = {
     "http://schemas.openxmlformats.org/spreadsheetml/2006/main",
     "http://schemas.openxmlformats.org/officeDocument/2006/sharedTypes",
     "http://www.w3.org/XML/1998/namespace",
-}
+})
 
 # Correspondance fichier XML → schema XSD.
 # "ppt" = tout fichier directement sous ppt/ (slides, layouts, masters)
@@ -83,8 +131,13 @@ IGNORED_XSD_ERRORS = [
     "purl.org/dc/terms",
     "{http://www.w3.org/XML/1998/namespace}space",
 ]
+_IGNORED_RE = re.compile("|".join(map(re.escape, IGNORED_XSD_ERRORS)))
+
+# Tags {{template}} retirés avant validation XSD (cf. _strip_template_tags)
+_TEMPLATE_RE = re.compile(r"\{\{[^}]*\}\}")
 
 # Chemin vers les schemas XSD — relatif à ce fichier (dev) ou /app (Docker)
+@functools.lru_cache(maxsize=1)
 def _find_schemas_dir() -> Path:
     """Trouve le dossier schemas/ contenant les .xsd Office."""
     candidates = [
@@ -100,6 +153,98 @@ def _find_schemas_dir() -> Path:
     )
 
 
+# Un XMLSchema porte son propre error_log : deux threads qui valident avec
+# le même objet mélangent leurs erreurs. Les schemas compilés sont donc mis
+# en cache par thread (compilation ~20 ms, une fois par thread et par .xsd),
+# ce qui permet de valider en parallèle sans verrou. Les workers du pool
+# (cf. _executor) vivent aussi longtemps que le process : chacun ne compile
+# un .xsd qu'une fois, et non à chaque validate_pptx().
+_THREAD_SCHEMAS = threading.local()
+
+# lxml verrouille un parser pendant tout un parse : chaque thread a donc ses
+# propres parsers (XML du deck et fichiers .xsd), sinon les parses s'attendent
+_THREAD_PARSERS = threading.local()
+
+# Validation en parallèle (pool de threads) au-delà de ce nombre de fichiers ;
+# avec un parser par thread, lxml relâche le GIL pendant le parsing et la
+# validation XSD
+PARALLEL_FILES_THRESHOLD = 32
+_MAX_WORKERS = min(8, os.cpu_count() or 1)
+
+
+def _safe_parser() -> lxml.etree.XMLParser:
+    """Parser sûr (cf. _SAFE_PARSER_OPTIONS) propre au thread courant."""
+    parser = getattr(_THREAD_PARSERS, "safe", None)
+    if parser is None:
+        parser = _THREAD_PARSERS.safe = lxml.etree.XMLParser(**_SAFE_PARSER_OPTIONS)
+    return parser
+
+
+def _xsd_parser() -> lxml.etree.XMLParser:
+    """Parser des fichiers .xsd propre au thread courant."""
+    parser = getattr(_THREAD_PARSERS, "xsd", None)
+    if parser is None:
+        parser = _THREAD_PARSERS.xsd = lxml.etree.XMLParser()
+    return parser
+
+
+def _load_schema(schema_path: Path) -> lxml.etree.XMLSchema:
+    """Charge et compile un schema XSD (une seule fois par thread)."""
+    cache = getattr(_THREAD_SCHEMAS, "by_path", None)
+    if cache is None:
+        cache = _THREAD_SCHEMAS.by_path = {}
+    schema = cache.get(schema_path)
+    if schema is None:
+        with open(schema_path, "rb") as xsd_fh:
+            xsd_doc = lxml.etree.parse(xsd_fh, parser=_xsd_parser(), base_url=str(schema_path))
+        schema = cache[schema_path] = lxml.etree.XMLSchema(xsd_doc)
+    return schema
+
+
+def _schema_for(key: str) -> lxml.etree.XMLSchema:
+    """
+    Schema compilé pour une clé de SCHEMA_MAPPINGS (cf. _schema_key).
+    Les clés qui pointent vers le même .xsd partagent le même objet.
+    """
+    return _load_schema(_find_schemas_dir() / SCHEMA_MAPPINGS[key])
+
+
+def _schema_errors(schema: lxml.etree.XMLSchema, xml_doc) -> list[str]:
+    """Valide xml_doc et retourne les messages d'erreur (liste vide si valide)."""
+    if schema.validate(xml_doc):
+        return []
+    return [error.message for error in schema.error_log]
+
+
+# Erreurs XSD des parts originales, par empreinte de contenu (LRU)
+ORIGINAL_ERRORS_CACHE_SIZE = 512
+_original_errors_cache: OrderedDict[tuple, frozenset[str]] = OrderedDict()
+_original_errors_lock = threading.Lock()
+
+
+# Pool de threads partagé, créé au premier besoin puis conservé
+_pool: ThreadPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+def _executor() -> ThreadPoolExecutor:
+    """Pool de validation du module (mêmes threads, donc mêmes caches, d'un appel à l'autre)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                max_workers=_MAX_WORKERS, thread_name_prefix="pptx-validate"
+            )
+        return _pool
+
+
+def _map_files(func, items: list) -> list:
+    """map(func, items), dans le pool de threads si la liste est assez longue."""
+    if len(items) > PARALLEL_FILES_THRESHOLD and _MAX_WORKERS > 1:
+        return list(_executor().map(func, items))
+    return [func(item) for item in items]
+
+
 # ============================================================
 # Validation rapide d'un slide XML (pour le retry loop)
 # ============================================================
@@ -122,19 +267,14 @@ def validate_slide_xml_string(xml_string: str) -> tuple[bool, str]:
     # 1. Vérifier que le XML se parse
     try:
         xml_doc = lxml.etree.ElementTree(
-            lxml.etree.fromstring(xml_string.encode("utf-8"))
+            lxml.etree.fromstring(xml_string.encode("utf-8"), _safe_parser())
         )
     except lxml.etree.XMLSyntaxError as e:
         return False, f"XML mal formé : {e}"
 
-    # 2. Charger le schema pml.xsd
+    # 2. Charger le schema pml.xsd (compilé une fois, puis en cache)
     try:
-        schemas_dir = _find_schemas_dir()
-        schema_path = schemas_dir / SCHEMA_MAPPINGS["ppt"]
-        with open(schema_path, "rb") as xsd_fh:
-            parser = lxml.etree.XMLParser()
-            xsd_doc = lxml.etree.parse(xsd_fh, parser=parser, base_url=str(schema_path))
-            schema = lxml.etree.XMLSchema(xsd_doc)
+        schema = _schema_for("ppt")
     except Exception:
         # Schema indisponible → fallback sur validation parsing seule
         return True, ""
@@ -144,15 +284,11 @@ def validate_slide_xml_string(xml_string: str) -> tuple[bool, str]:
     xml_doc = _strip_mc_ignorable(xml_doc)
     xml_doc = _strip_non_ooxml(xml_doc)
 
-    # 4. Valider contre le schema
-    if schema.validate(xml_doc):
-        return True, ""
-
-    # Filtrer les erreurs bénignes connues
-    real_errors = []
-    for error in schema.error_log:
-        if not any(ignored in error.message for ignored in IGNORED_XSD_ERRORS):
-            real_errors.append(error.message)
+    # 4. Valider contre le schema, en filtrant les erreurs bénignes connues
+    real_errors = [
+        message for message in _schema_errors(schema, xml_doc)
+        if not _IGNORED_RE.search(message)
+    ]
 
     if not real_errors:
         return True, ""
@@ -187,30 +323,39 @@ def validate_pptx(unpacked_dir: str, original_bytes: bytes = None) -> dict:
         - xsd_errors (list[str]) : erreurs XSD (nouvelles uniquement si original fourni)
     """
     path = Path(unpacked_dir)
-    xml_files = list(path.rglob("*.xml")) + list(path.rglob("*.rels"))
+    # Un seul parcours du dossier : fichiers XML à parser et set des fichiers
+    # existants pour la vérification des références
+    files = _list_files(path)
+    existing = set(files)
+    xml_files = [path / f for f in files if f.endswith(".xml")]
+    xml_files += [path / f for f in files if f.endswith(".rels")]
 
-    # --- Auto-repair ---
-    repairs = _repair_whitespace(xml_files)
+    # Chaque fichier est parsé une seule fois ; les checks travaillent sur ces arbres.
+    # 1. XML bien formé = tout ce qui a pu être parsé
+    parsed, xml_errors = _parse_all(xml_files, path)
 
-    # --- Checks structurels ---
-    errors = []
+    # --- Auto-repair ---
+    repairs = _repair_whitespace(parsed)
 
-    # 1. XML bien formé — si ça échoue, les autres checks vont planter
-    xml_errors = _check_wellformed_xml(xml_files, path)
     if xml_errors:
+        # Si ça échoue, les autres checks vont planter
         return {"valid": False, "repairs": repairs, "errors": xml_errors, "xsd_errors": []}
 
+    # --- Checks structurels ---
+    errors = []
+
     # 2-8. Checks structurels
-    errors += _check_namespaces(xml_files, path)
-    errors += _check_unique_ids(xml_files, path)
-    errors += _check_file_references(xml_files, path)
-    errors += _check_content_types(path)
-    errors += _check_slide_layout_ids(path)
-    errors += _check_no_duplicate_layouts(path)
-    errors += _check_notes_slides(path)
+    errors += _check_namespaces(parsed, path)
+    errors += _check_unique_ids(parsed, path)
+    errors += _check_file_references(parsed, path, existing)
+    errors += _check_content_types(path, parsed)
+    errors += _check_slide_layout_ids(path, parsed)
+    errors += _check_no_duplicate_layouts(path, parsed)
+    errors += _check_notes_slides(path, parsed)
 
     # --- Validation XSD ---
-    xsd_errors = _check_xsd(xml_files, path, original_bytes)
+    # En dernier : la validation XSD modifie puis vide les arbres de parsed
+    xsd_errors = _check_xsd(parsed, path, original_bytes)
 
     return {
         "valid": len(errors) == 0 and len(xsd_errors) == 0,
@@ -220,34 +365,74 @@ def validate_pptx(unpacked_dir: str, original_bytes: bytes = None) -> dict:
     }
 
 
+def _list_files(base: Path) -> list[str]:
+    """
+    Chemins relatifs (en "/") de tous les fichiers sous base, en une seule
+    passe os.scandir (pile explicite, pas d'objet Path par entrée).
+    """
+    prefix_len = len(str(base)) + 1
+    files = []
+    stack = [str(base)]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        files.append(entry.path[prefix_len:].replace(os.sep, "/"))
+        except FileNotFoundError:
+            continue
+    return files
+
+
+def _parse_all(
+    xml_files: list[Path], base: Path
+) -> tuple[dict[Path, lxml.etree._ElementTree], list[str]]:
+    """
+    Parse chaque fichier une fois (parser propre à chaque thread).
+    Retourne ({fichier: arbre}, erreurs) — les fichiers mal formés sont
+    absents du dict et signalés dans erreurs.
+    """
+    def parse_one(f: Path):
+        try:
+            return lxml.etree.parse(str(f), _safe_parser()), None
+        except lxml.etree.XMLSyntaxError as e:
+            return None, f"XML invalide — {f.relative_to(base)}: ligne {e.lineno}: {e.msg}"
+
+    parsed, errors = {}, []
+    for f, (tree, error) in zip(xml_files, _map_files(parse_one, xml_files)):
+        if error:
+            errors.append(error)
+        else:
+            parsed[f] = tree
+    return parsed, errors
+
+
 # ============================================================
 # Auto-repair
 # ============================================================
 
-def _repair_whitespace(xml_files: list[Path]) -> int:
+def _repair_whitespace(parsed: dict[Path, lxml.etree._ElementTree]) -> int:
     """
     Ajoute xml:space="preserve" sur les <a:t> dont le texte commence
     ou finit par un espace. Sans ça, PowerPoint supprime silencieusement
     ces espaces à l'ouverture.
+
+    Les arbres de parsed sont modifiés en place ; seuls les fichiers
+    réparés sont réécrits sur disque.
     """
     repairs = 0
-    for xml_file in xml_files:
+    for xml_file, tree in parsed.items():
         try:
-            content = xml_file.read_text(encoding="utf-8")
-            dom = defusedxml.minidom.parseString(content)
-            modified = False
-
-            for elem in dom.getElementsByTagName("*"):
-                if elem.tagName.endswith(":t") and elem.firstChild:
-                    text = elem.firstChild.nodeValue
-                    if text and (text.startswith((" ", "\t")) or text.endswith((" ", "\t"))):
-                        if elem.getAttribute("xml:space") != "preserve":
-                            elem.setAttribute("xml:space", "preserve")
-                            repairs += 1
-                            modified = True
-
-            if modified:
-                xml_file.write_bytes(dom.toxml(encoding="UTF-8"))
+            hits = _WS_TEXT_XPATH(tree)
+            if not hits:
+                continue
+
+            for elem in hits:
+                elem.set(XML_SPACE_ATTR, "preserve")
+            repairs += len(hits)
+            tree.write(str(xml_file), xml_declaration=True, encoding="UTF-8", standalone=True)
         except Exception:
             logger.debug("Skipping whitespace repair for: %s", xml_file.name)
     return repairs
@@ -257,183 +442,180 @@ def _repair_whitespace(xml_files: list[Path]) -> int:
 # Checks structurels
 # ============================================================
 
-def _check_wellformed_xml(xml_files: list[Path], base: Path) -> list[str]:
-    """Vérifie que chaque fichier XML est parsable."""
-    errors = []
-    for f in xml_files:
-        try:
-            lxml.etree.parse(str(f))
-        except lxml.etree.XMLSyntaxError as e:
-            errors.append(f"XML invalide — {f.relative_to(base)}: ligne {e.lineno}: {e.msg}")
-    return errors
-
-
-def _check_namespaces(xml_files: list[Path], base: Path) -> list[str]:
+def _check_namespaces(parsed: dict[Path, lxml.etree._ElementTree], base: Path) -> list[str]:
     """Vérifie que mc:Ignorable ne référence pas de préfixes non déclarés."""
     errors = []
-    for f in xml_files:
-        try:
-            root = lxml.etree.parse(str(f)).getroot()
-            declared = set(root.nsmap.keys()) - {None}
-            for attr_val in [v for k, v in root.attrib.items() if k.endswith("Ignorable")]:
-                for ns in set(attr_val.split()) - declared:
-                    errors.append(
-                        f"Namespace non déclaré — {f.relative_to(base)}: "
-                        f"'{ns}' dans Ignorable mais pas déclaré"
-                    )
-        except lxml.etree.XMLSyntaxError:
+    for f, tree in parsed.items():
+        root = tree.getroot()
+        # mc:Ignorable ne peut se trouver que sur le root : cas courant = absent
+        ignorable = root.get(MC_IGNORABLE_ATTR)
+        if not ignorable:
             continue
+        declared = root.nsmap
+        for ns in set(ignorable.split()):
+            if ns not in declared:
+                errors.append(
+                    f"Namespace non déclaré — {f.relative_to(base)}: "
+                    f"'{ns}' dans Ignorable mais pas déclaré"
+                )
     return errors
 
 
-def _check_unique_ids(xml_files: list[Path], base: Path) -> list[str]:
+def _check_unique_ids(parsed: dict[Path, lxml.etree._ElementTree], base: Path) -> list[str]:
     """
     Vérifie l'unicité des IDs critiques :
     - sp, pic, cxnSp, grpSp (shape IDs) : uniques par fichier
     - sldMasterId, sldLayoutId : uniques globalement
     - sldId : unique par fichier
     """
-    FILE_SCOPE = {"sldid", "sp", "pic", "cxnsp", "grpsp"}
-    GLOBAL_SCOPE = {"sldmasterid", "sldlayoutid"}
-
     errors = []
     global_ids = {}  # id_value → (fichier, tag)
+    masters_dir = base / "ppt" / "slideMasters"
+    presentation_xml = base / "ppt" / "presentation.xml"
 
-    for f in xml_files:
+    for f, tree in parsed.items():
         try:
-            root = lxml.etree.parse(str(f)).getroot()
-            file_ids = {}  # id_value → tag
+            root = tree.getroot()
+            rel = f.relative_to(base)
 
-            for elem in root.iter():
-                tag = elem.tag.split("}")[-1].lower() if "}" in elem.tag else elem.tag.lower()
-                if tag not in FILE_SCOPE and tag not in GLOBAL_SCOPE:
+            # Scope fichier — filtrage par tag fait par libxml2 (tous namespaces)
+            file_ids = {}  # id_value → tag
+            for elem in root.iter(*_FILE_ID_TAGS):
+                id_value = _elem_id(elem)
+                if id_value is None:
                     continue
+                tag = elem.tag.rpartition("}")[2].lower()
+                if id_value in file_ids:
+                    errors.append(
+                        f"ID dupliqué (fichier) — {rel}: <{tag}> id='{id_value}' "
+                        f"déjà utilisé par <{file_ids[id_value]}>"
+                    )
+                else:
+                    file_ids[id_value] = tag
 
-                # Chercher l'attribut "id"
-                id_value = None
-                for attr, value in elem.attrib.items():
-                    attr_local = attr.split("}")[-1].lower() if "}" in attr else attr.lower()
-                    if attr_local == "id":
-                        id_value = value
-                        break
+            # Scope global — sldMasterId (presentation.xml), sldLayoutId (slideMasters)
+            if f != presentation_xml and f.parent != masters_dir:
+                continue
+            for elem in root.iter(*_GLOBAL_ID_TAGS):
+                id_value = _elem_id(elem)
                 if id_value is None:
                     continue
-
-                rel = f.relative_to(base)
-
-                if tag in GLOBAL_SCOPE:
-                    if id_value in global_ids:
-                        prev_file, prev_tag = global_ids[id_value]
-                        errors.append(
-                            f"ID dupliqué (global) — {rel}: <{tag}> id='{id_value}' "
-                            f"déjà utilisé dans {prev_file} (<{prev_tag}>)"
-                        )
-                    else:
-                        global_ids[id_value] = (rel, tag)
+                tag = elem.tag.rpartition("}")[2].lower()
+                if id_value in global_ids:
+                    prev_file, prev_tag = global_ids[id_value]
+                    errors.append(
+                        f"ID dupliqué (global) — {rel}: <{tag}> id='{id_value}' "
+                        f"déjà utilisé dans {prev_file} (<{prev_tag}>)"
+                    )
                 else:
-                    if id_value in file_ids:
-                        errors.append(
-                            f"ID dupliqué (fichier) — {rel}: <{tag}> id='{id_value}' "
-                            f"déjà utilisé par <{file_ids[id_value]}>"
-                        )
-                    else:
-                        file_ids[id_value] = tag
+                    global_ids[id_value] = (rel, tag)
         except Exception:
             logger.debug("Skipping ID check for: %s", f.name)
             continue
     return errors
 
 
-def _check_file_references(xml_files: list[Path], base: Path) -> list[str]:
-    """Vérifie que chaque Target dans les .rels pointe vers un fichier existant."""
+def _elem_id(elem) -> str | None:
+    """Attribut id d'un élément (id, sinon r:id)."""
+    id_value = elem.get("id")
+    if id_value is None:
+        id_value = elem.get(_R_ID_ATTR)
+    return id_value
+
+
+def _check_file_references(
+    parsed: dict[Path, lxml.etree._ElementTree], base: Path, existing: set[str]
+) -> list[str]:
+    """
+    Vérifie que chaque Target dans les .rels pointe vers un fichier existant.
+    existing : chemins relatifs (en "/") des fichiers du deck (cf. _list_files).
+    """
     errors = []
-    for rels_file in [f for f in xml_files if f.suffix == ".rels"]:
+
+    for rels_file, tree in parsed.items():
+        if rels_file.suffix != ".rels":
+            continue
+        rel_name = rels_file.relative_to(base).as_posix()
         try:
-            root = lxml.etree.parse(str(rels_file)).getroot()
-            for rel in root.findall(f".//{{{PKG_RELS_NS}}}Relationship"):
+            # Les cibles relatives partent du dossier parent de _rels/
+            # ("" pour le /_rels/.rels du package) — opérations str, sans Path
+            source_dir = posixpath.dirname(posixpath.dirname(rel_name))
+
+            for rel in _REL_XPATH(tree.getroot()):
                 target = rel.get("Target", "")
                 if not target or target.startswith(("http", "mailto:")):
                     continue
 
                 if target.startswith("/"):
-                    target_path = base / target.lstrip("/")
-                elif rels_file.name == ".rels":
-                    target_path = base / target
+                    key = posixpath.normpath(target.lstrip("/"))
                 else:
-                    target_path = rels_file.parent.parent / target
-
-                try:
-                    if not target_path.resolve().exists():
-                        errors.append(
-                            f"Référence cassée — {rels_file.relative_to(base)}: "
-                            f"'{target}' n'existe pas"
-                        )
-                except (OSError, ValueError):
+                    key = posixpath.normpath(posixpath.join(source_dir, target))
+
+                if key == ".." or key.startswith("../"):
+                    errors.append(
+                        f"Référence invalide — {rel_name}: '{target}'"
+                    )
+                elif key not in existing:
                     errors.append(
-                        f"Référence invalide — {rels_file.relative_to(base)}: '{target}'"
+                        f"Référence cassée — {rel_name}: "
+                        f"'{target}' n'existe pas"
                     )
         except Exception as e:
-            errors.append(f"Erreur parsing — {rels_file.relative_to(base)}: {e}")
+            errors.append(f"Erreur parsing — {rel_name}: {e}")
     return errors
 
 
-def _check_content_types(base: Path) -> list[str]:
+def _check_content_types(base: Path, parsed: dict[Path, lxml.etree._ElementTree]) -> list[str]:
     """Vérifie que les fichiers importants sont déclarés dans [Content_Types].xml."""
     errors = []
     ct_path = base / "[Content_Types].xml"
-    if not ct_path.exists():
+    ct_tree = parsed.get(ct_path)
+    if ct_tree is None:
         return ["[Content_Types].xml introuvable"]
 
-    try:
-        root = lxml.etree.parse(str(ct_path)).getroot()
-        declared = set()
-        for override in root.findall(f".//{{{CONTENT_TYPES_NS}}}Override"):
-            part = override.get("PartName", "").lstrip("/")
-            if part:
-                declared.add(part)
-
-        important_roots = {"sld", "sldLayout", "sldMaster", "presentation", "theme"}
-        for xml_file in base.rglob("*.xml"):
-            if "_rels" in xml_file.parts or xml_file.name == "[Content_Types].xml":
-                continue
-            if "docProps" in xml_file.parts:
-                continue
-            try:
-                file_root = lxml.etree.parse(str(xml_file)).getroot()
-                root_name = file_root.tag.split("}")[-1] if "}" in file_root.tag else file_root.tag
-                rel_path = str(xml_file.relative_to(base)).replace("\\", "/")
-                if root_name in important_roots and rel_path not in declared:
-                    errors.append(
-                        f"Content_Types manquant — {rel_path} (root: <{root_name}>) "
-                        f"pas déclaré dans [Content_Types].xml"
-                    )
-            except Exception:
-                logger.debug("Skipping content type check for: %s", xml_file.name)
-                continue
-    except Exception as e:
-        errors.append(f"Erreur parsing [Content_Types].xml: {e}")
+    declared = set()
+    for override in _OVERRIDE_XPATH(ct_tree.getroot()):
+        part = override.get("PartName", "").lstrip("/")
+        if part:
+            declared.add(part)
+
+    for xml_file, tree in parsed.items():
+        if xml_file.suffix != ".xml" or xml_file == ct_path:
+            continue
+        rel_path = xml_file.relative_to(base).as_posix()
+        # Un <Default Extension="xml"> (application/xml) ne couvre pas les parts
+        # pptx : seul un Override déclaré compte, inutile alors de lire la racine
+        if rel_path in declared or rel_path.startswith("docProps/") or "_rels/" in rel_path:
+            continue
+        root_name = tree.getroot().tag.rpartition("}")[2]
+        if root_name in CT_IMPORTANT_ROOTS:
+            errors.append(
+                f"Content_Types manquant — {rel_path} (root: <{root_name}>) "
+                f"pas déclaré dans [Content_Types].xml"
+            )
     return errors
 
 
-def _check_slide_layout_ids(base: Path) -> list[str]:
-    """Vérifie que les sldLayoutId dans les slideMasters référencent des relations existantes."""
+def _check_slide_layout_ids(base: Path, parsed: dict[Path, lxml.etree._ElementTree]) -> list[str]:
+    """
+    Vérifie que les sldLayoutId dans les slideMasters référencent des relations existantes.
+    Lit les masters et leurs .rels dans les arbres déjà parsés (pas de re-lecture).
+    """
     errors = []
-    for master in base.glob("ppt/slideMasters/*.xml"):
+    masters_dir = base / "ppt" / "slideMasters"
+    for master, tree in parsed.items():
+        if master.parent != masters_dir or master.suffix != ".xml":
+            continue
         try:
-            root = lxml.etree.parse(str(master)).getroot()
-            rels_file = master.parent / "_rels" / f"{master.name}.rels"
-            if not rels_file.exists():
+            rels_tree = parsed.get(masters_dir / "_rels" / f"{master.name}.rels")
+            if rels_tree is None:
                 errors.append(f"Fichier .rels manquant pour {master.relative_to(base)}")
                 continue
 
-            rels_root = lxml.etree.parse(str(rels_file)).getroot()
-            valid_rids = set()
-            for rel in rels_root.findall(f".//{{{PKG_RELS_NS}}}Relationship"):
-                if "slideLayout" in rel.get("Type", ""):
-                    valid_rids.add(rel.get("Id"))
+            valid_rids = set(_LAYOUT_REL_IDS_XPATH(rels_tree.getroot()))
 
-            for layout_id_elem in root.findall(f".//{{{PML_NS}}}sldLayoutId"):
-                rid = layout_id_elem.get(f"{{{OFFICE_RELS_NS}}}id")
+            for layout_id_elem in _SLDLAYOUTID_XPATH(tree.getroot()):
+                rid = layout_id_elem.get(_R_ID_ATTR)
                 if rid and rid not in valid_rids:
                     errors.append(
                         f"Layout ID invalide — {master.relative_to(base)}: "
@@ -445,16 +627,18 @@ def _check_slide_layout_ids(base: Path) -> list[str]:
     return errors
 
 
-def _check_no_duplicate_layouts(base: Path) -> list[str]:
-    """Vérifie que chaque slide a exactement un slideLayout dans ses .rels."""
+def _check_no_duplicate_layouts(base: Path, parsed: dict[Path, lxml.etree._ElementTree]) -> list[str]:
+    """
+    Vérifie que chaque slide a exactement un slideLayout dans ses .rels.
+    Lit les .rels des slides dans les arbres déjà parsés (pas de re-lecture).
+    """
     errors = []
-    for rels_file in base.glob("ppt/slides/_rels/*.xml.rels"):
+    slides_rels_dir = base / "ppt" / "slides" / "_rels"
+    for rels_file, tree in parsed.items():
+        if rels_file.parent != slides_rels_dir or not rels_file.name.endswith(".xml.rels"):
+            continue
         try:
-            root = lxml.etree.parse(str(rels_file)).getroot()
-            layout_count = sum(
-                1 for rel in root.findall(f".//{{{PKG_RELS_NS}}}Relationship")
-                if "slideLayout" in rel.get("Type", "")
-            )
+            layout_count = len(_LAYOUT_RELS_XPATH(tree.getroot()))
             if layout_count > 1:
                 errors.append(
                     f"Layouts dupliqués — {rels_file.relative_to(base)}: "
@@ -466,22 +650,21 @@ def _check_no_duplicate_layouts(base: Path) -> list[str]:
     return errors
 
 
-def _check_notes_slides(base: Path) -> list[str]:
-    """Vérifie que chaque notesSlide n'est référencée que par une seule slide."""
+def _check_notes_slides(base: Path, parsed: dict[Path, lxml.etree._ElementTree]) -> list[str]:
+    """
+    Vérifie que chaque notesSlide n'est référencée que par une seule slide.
+    Lit les .rels des slides dans les arbres déjà parsés (pas de re-lecture).
+    """
     errors = []
     notes_refs = {}  # target → [slide1, slide2, ...]
+    slides_rels_dir = base / "ppt" / "slides" / "_rels"
 
-    for rels_file in base.glob("ppt/slides/_rels/*.xml.rels"):
-        try:
-            root = lxml.etree.parse(str(rels_file)).getroot()
-            slide_name = rels_file.stem.replace(".xml", "")
-            for rel in root.findall(f".//{{{PKG_RELS_NS}}}Relationship"):
-                if "notesSlide" in rel.get("Type", ""):
-                    target = rel.get("Target", "").replace("../", "")
-                    notes_refs.setdefault(target, []).append(slide_name)
-        except Exception:
-            logger.debug("Skipping notes check for: %s", rels_file.name)
+    for rels_file, tree in parsed.items():
+        if rels_file.parent != slides_rels_dir or not rels_file.name.endswith(".xml.rels"):
             continue
+        slide_name = rels_file.stem.replace(".xml", "")
+        for target in _NOTES_REL_TARGETS_XPATH(tree):
+            notes_refs.setdefault(target.replace("../", ""), []).append(slide_name)
 
     for target, slides in notes_refs.items():
         if len(slides) > 1:
@@ -512,81 +695,117 @@ def _check_notes_slides(base: Path) -> list[str]:
 #    on ne remonte que les NOUVELLES erreurs (pas celles pré-existantes)
 # ============================================================
 
-def _check_xsd(xml_files: list[Path], base: Path, original_bytes: bytes = None) -> list[str]:
+def _check_xsd(
+    parsed: dict[Path, lxml.etree._ElementTree], base: Path, original_bytes: bytes = None
+) -> list[str]:
     """
     Valide chaque fichier XML contre son schema XSD Office.
+    Les arbres de parsed sont pré-traités puis vidés en place : à appeler en dernier.
 
-    Si original_bytes est fourni, on décompresse le PPTX original dans un dossier
-    temporaire et on compare : seules les erreurs NOUVELLES sont remontées.
-    Ça évite de remonter des erreurs qui existaient déjà dans le template d'origine.
+    Si original_bytes est fourni, on compare avec le PPTX original : seules les
+    erreurs NOUVELLES sont remontées. Ça évite de remonter des erreurs qui
+    existaient déjà dans le template d'origine. L'original n'est pas décompressé :
+    seules les parts en erreur dans le deck modifié sont lues depuis le zip.
     """
     try:
-        schemas_dir = _find_schemas_dir()
+        _find_schemas_dir()
     except FileNotFoundError:
         return ["XSD: dossier schemas/ introuvable — validation XSD skippée"]
 
     errors = []
 
-    # Si on a l'original, on le décompresse pour pouvoir comparer
-    original_dir = None
-    temp_obj = None
+    # Si on a l'original, on garde le zip ouvert pour lire les parts à la demande
+    original_zip = None
+    original_names = set()
     if original_bytes:
-        temp_obj = tempfile.TemporaryDirectory()
-        original_dir = Path(temp_obj.name)
         try:
-            import io
-            with zipfile.ZipFile(io.BytesIO(original_bytes), "r") as zf:
-                zf.extractall(original_dir)
+            original_zip = zipfile.ZipFile(io.BytesIO(original_bytes), "r")
+            original_names = set(original_zip.namelist())
         except Exception:
-            original_dir = None
+            original_zip = None
 
-    try:
-        for xml_file in xml_files:
-            relative = xml_file.relative_to(base)
+    def check_one(item) -> list[str]:
+        xml_file, xml_doc = item
+        relative = xml_file.relative_to(base)
 
-            # Trouver le schema
-            schema_path = _get_schema_path(xml_file, base, schemas_dir)
-            if schema_path is None:
-                continue  # Pas de schema pour ce type de fichier → on skip
-
-            # Valider le fichier modifié
-            current_errors = _validate_one_file_xsd(xml_file, base, schema_path)
-            if current_errors is None:
-                continue  # Erreur de parsing du schema → skip
-            if not current_errors:
-                continue  # Pas d'erreurs → OK
-
-            # Si on a l'original, calculer les erreurs pré-existantes
-            if original_dir:
-                original_xml = original_dir / relative
-                if original_xml.exists():
-                    original_errors = _validate_one_file_xsd(original_xml, original_dir, schema_path)
-                    original_errors = original_errors or set()
-                    # Garder uniquement les NOUVELLES erreurs
-                    current_errors = current_errors - original_errors
-
-            # Filtrer les erreurs bénignes connues
-            current_errors = {
-                e for e in current_errors
-                if not any(pattern in e for pattern in IGNORED_XSD_ERRORS)
-            }
-
-            if current_errors:
-                errors.append(f"XSD — {relative}: {len(current_errors)} erreur(s)")
-                for err in list(current_errors)[:3]:
-                    truncated = err[:200] + "..." if len(err) > 200 else err
-                    errors.append(f"  → {truncated}")
+        # Trouver le schema
+        schema_key = _schema_key(xml_file, base)
+        if schema_key is None:
+            return []  # Pas de schema pour ce type de fichier → on skip
+
+        # Valider le fichier modifié
+        current_errors = _validate_one_file_xsd(xml_file, base, schema_key, xml_doc)
+        if not current_errors:
+            return []  # Pas d'erreurs (ou schema illisible → None) → OK
+
+        # Si on a l'original, calculer les erreurs pré-existantes
+        member = relative.as_posix()
+        if original_zip is not None and member in original_names:
+            original_errors = _original_xsd_errors(
+                original_zip.read(member), xml_file, base, schema_key
+            )
+            # Garder uniquement les NOUVELLES erreurs
+            current_errors = current_errors - original_errors
+
+        # Filtrer les erreurs bénignes connues
+        current_errors = {
+            e for e in current_errors
+            if not _IGNORED_RE.search(e)
+        }
+
+        if not current_errors:
+            return []
+        lines = [f"XSD — {relative}: {len(current_errors)} erreur(s)"]
+        for err in list(current_errors)[:3]:
+            truncated = err[:200] + "..." if len(err) > 200 else err
+            lines.append(f"  → {truncated}")
+        return lines
+
+    try:
+        # Chaque fichier produit ses lignes d'erreur ; assemblées dans l'ordre
+        for lines in _map_files(check_one, list(parsed.items())):
+            errors.extend(lines)
 
     finally:
-        if temp_obj:
-            temp_obj.cleanup()
+        if original_zip is not None:
+            original_zip.close()
+
+    return errors
+
 
+def _original_xsd_errors(
+    data: bytes, xml_file: Path, base: Path, schema_key: str
+) -> frozenset[str]:
+    """
+    Erreurs XSD d'une part du PPTX original (data = contenu brut de la part).
+
+    Mémoïsé par empreinte blake2b du contenu : un même template édité
+    plusieurs fois n'est validé qu'une fois par part.
+    """
+    in_ppt = xml_file.relative_to(base).parts[:1] == ("ppt",)
+    key = (hashlib.blake2b(data, digest_size=16).digest(), schema_key, in_ppt)
+    with _original_errors_lock:
+        cached = _original_errors_cache.get(key)
+        if cached is not None:
+            _original_errors_cache.move_to_end(key)
+            return cached
+
+    try:
+        original_doc = lxml.etree.ElementTree(lxml.etree.fromstring(data, _safe_parser()))
+        errors = frozenset(_validate_one_file_xsd(xml_file, base, schema_key, original_doc) or ())
+    except Exception as e:
+        errors = frozenset({str(e)})
+
+    with _original_errors_lock:
+        _original_errors_cache[key] = errors
+        while len(_original_errors_cache) > ORIGINAL_ERRORS_CACHE_SIZE:
+            _original_errors_cache.popitem(last=False)
     return errors
 
 
-def _get_schema_path(xml_file: Path, base: Path, schemas_dir: Path) -> Path | None:
+def _schema_key(xml_file: Path, base: Path) -> str | None:
     """
-    Trouve le schema XSD correspondant à un fichier XML.
+    Trouve la clé SCHEMA_MAPPINGS du schema XSD correspondant à un fichier XML.
 
     Logique :
     - Fichier nommé explicitement (app.xml, core.xml, etc.) → mapping direct
@@ -598,34 +817,38 @@ def _get_schema_path(xml_file: Path, base: Path, schemas_dir: Path) -> Path | No
     """
     # Mapping par nom de fichier
     if xml_file.name in SCHEMA_MAPPINGS:
-        return schemas_dir / SCHEMA_MAPPINGS[xml_file.name]
+        return xml_file.name
 
     # Tous les .rels
     if xml_file.suffix == ".rels":
-        return schemas_dir / SCHEMA_MAPPINGS[".rels"]
+        return ".rels"
 
     # Charts
     if "charts/" in str(xml_file) and xml_file.name.startswith("chart"):
-        return schemas_dir / SCHEMA_MAPPINGS["chart"]
+        return "chart"
 
     # Themes
     if "theme/" in str(xml_file) and xml_file.name.startswith("theme"):
-        return schemas_dir / SCHEMA_MAPPINGS["theme"]
+        return "theme"
 
     # Fichiers dans ppt/ (slides, slideLayouts, slideMasters, etc.)
     try:
         relative = xml_file.relative_to(base)
         if relative.parts and relative.parts[0] == "ppt":
-            return schemas_dir / SCHEMA_MAPPINGS["ppt"]
+            return "ppt"
     except ValueError:
         pass
 
     return None
 
 
-def _validate_one_file_xsd(xml_file: Path, base: Path, schema_path: Path) -> set[str] | None:
+def _validate_one_file_xsd(
+    xml_file: Path, base: Path, schema_key: str, xml_doc: lxml.etree._ElementTree = None
+) -> set[str] | None:
     """
     Valide un fichier XML contre un schema XSD.
+    xml_doc : arbre déjà parsé de xml_file (sinon le fichier est lu) ;
+    il est vidé après validation, l'appelant ne doit plus l'utiliser.
 
     Avant validation, nettoie le XML :
     - Retire mc:Ignorable (Mark Compatibility, extensions Microsoft)
@@ -636,17 +859,15 @@ def _validate_one_file_xsd(xml_file: Path, base: Path, schema_path: Path) -> set
         set d'erreurs (vide si valide), ou None si le schema ne peut pas être chargé.
     """
     try:
-        # Charger le schema XSD
-        with open(schema_path, "rb") as xsd_fh:
-            parser = lxml.etree.XMLParser()
-            xsd_doc = lxml.etree.parse(xsd_fh, parser=parser, base_url=str(schema_path))
-            schema = lxml.etree.XMLSchema(xsd_doc)
+        # Schema XSD compilé (en cache après le premier appel)
+        schema = _schema_for(schema_key)
     except Exception:
         return None  # Schema invalide ou manquant → skip
 
     try:
         # Charger et pré-traiter le XML
-        xml_doc = lxml.etree.parse(str(xml_file))
+        if xml_doc is None:
+            xml_doc = lxml.etree.parse(str(xml_file), _safe_parser())
         xml_doc = _strip_template_tags(xml_doc)
         xml_doc = _strip_mc_ignorable(xml_doc)
 
@@ -659,21 +880,21 @@ def _validate_one_file_xsd(xml_file: Path, base: Path, schema_path: Path) -> set
             pass
 
         # Valider
-        if schema.validate(xml_doc):
-            return set()
-        else:
-            return {error.message for error in schema.error_log}
+        return set(_schema_errors(schema, xml_doc))
 
     except Exception as e:
         return {str(e)}
+    finally:
+        # Libérer les nœuds tout de suite plutôt qu'au passage du GC
+        if xml_doc is not None:
+            xml_doc.getroot().clear(keep_tail=False)
 
 
 def _strip_mc_ignorable(xml_doc: lxml.etree._ElementTree) -> lxml.etree._ElementTree:
     """Retire l'attribut mc:Ignorable du root element (Mark Compatibility)."""
     root = xml_doc.getroot()
-    mc_attr = f"{{{MC_NS}}}Ignorable"
-    if mc_attr in root.attrib:
-        del root.attrib[mc_attr]
+    if MC_IGNORABLE_ATTR in root.attrib:
+        del root.attrib[MC_IGNORABLE_ATTR]
     return xml_doc
 
 
@@ -684,41 +905,41 @@ def _strip_non_ooxml(xml_doc: lxml.etree._ElementTree) -> lxml.etree._ElementTre
     Microsoft ajoute des extensions propriétaires (a14:, a16:, etc.) que les
     schemas ISO ne connaissent pas. On les retire avant validation pour éviter
     des faux positifs.
+
+    L'arbre est modifié en place (et retourné).
     """
-    xml_string = lxml.etree.tostring(xml_doc, encoding="unicode")
-    root = lxml.etree.fromstring(xml_string)
+    root = xml_doc.getroot()
+
+    # Retirer les éléments non-OOXML (itératif : liste matérialisée puis retraits ;
+    # les descendants d'un élément retiré partent avec lui)
+    doomed = [
+        elem for elem in root.iterdescendants()
+        if isinstance(elem.tag, str) and _is_non_ooxml(elem.tag)
+    ]
+    for elem in doomed:
+        parent = elem.getparent()
+        if parent is not None:
+            parent.remove(elem)
 
-    # Retirer les attributs non-OOXML
+    # Retirer les attributs non-OOXML (les attributs sans namespace, la grande
+    # majorité, sont écartés dès le premier caractère)
     for elem in root.iter():
-        attrs_to_remove = [
-            attr for attr in elem.attrib
-            if "{" in attr and attr.split("}")[0][1:] not in OOXML_NAMESPACES
-        ]
+        attrib = elem.attrib
+        if not attrib:
+            continue
+        attrs_to_remove = tuple(
+            attr for attr in attrib
+            if attr[0] == "{" and attr[1:attr.index("}")] not in OOXML_NAMESPACES
+        )
         for attr in attrs_to_remove:
-            del elem.attrib[attr]
-
-    # Retirer les éléments non-OOXML (récursif)
-    _remove_non_ooxml_elements(root)
-
-    return lxml.etree.ElementTree(root)
+            del attrib[attr]
 
+    return xml_doc
 
-def _remove_non_ooxml_elements(parent):
-    """Supprime récursivement les éléments enfants dont le namespace n'est pas OOXML."""
-    to_remove = []
-    for elem in list(parent):
-        if not hasattr(elem, "tag") or callable(elem.tag):
-            continue
-        tag_str = str(elem.tag)
-        if tag_str.startswith("{"):
-            ns = tag_str.split("}")[0][1:]
-            if ns not in OOXML_NAMESPACES:
-                to_remove.append(elem)
-                continue
-        _remove_non_ooxml_elements(elem)
 
-    for elem in to_remove:
-        parent.remove(elem)
+def _is_non_ooxml(qname: str) -> bool:
+    """True si qname ("{ns}local") est dans un namespace hors OOXML_NAMESPACES."""
+    return qname[:1] == "{" and qname[1:].partition("}")[0] not in OOXML_NAMESPACES
 
 
 def _strip_template_tags(xml_doc: lxml.etree._ElementTree) -> lxml.etree._ElementTree:
@@ -727,21 +948,23 @@ def _strip_template_tags(xml_doc: lxml.etree._ElementTree) -> lxml.etree._Elemen
     (sauf des nœuds <a:t> / <w:t> qui sont du texte visible).
     Ces tags sont utilisés pour les templates dynamiques mais ne sont
     pas valides selon les schemas XSD.
+
+    L'arbre est modifié en place (et retourné).
     """
-    template_re = re.compile(r"\{\{[^}]*\}\}")
-    xml_string = lxml.etree.tostring(xml_doc, encoding="unicode")
-    root = lxml.etree.fromstring(xml_string)
+    root = xml_doc.getroot()
 
-    for elem in root.iter():
-        if not hasattr(elem, "tag") or callable(elem.tag):
-            continue
-        tag_str = str(elem.tag)
+    # Éléments uniquement (pas les commentaires / PI), filtrés par libxml2
+    for elem in root.iter(lxml.etree.Element):
+        tag_str = elem.tag
         # Ne pas toucher aux nœuds de texte visible
         if tag_str.endswith("}t") or tag_str == "t":
             continue
-        if elem.text and template_re.search(elem.text):
-            elem.text = template_re.sub("", elem.text)
-        if elem.tail and template_re.search(elem.tail):
-            elem.tail = template_re.sub("", elem.tail)
+        # Test de sous-chaîne (bien moins cher qu'une regex) avant le sub
+        text = elem.text
+        if text and "{{" in text:
+            elem.text = _TEMPLATE_RE.sub("", text)
+        tail = elem.tail
+        if tail and "{{" in tail:
+            elem.tail = _TEMPLATE_RE.sub("", tail)
 
-    return lxml.etree.ElementTree(root)
+    return xml_doc
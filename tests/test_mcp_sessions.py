@@ -0,0 +1,49 @@
+"""Sessions MCP SSE : éviction au-delà de MCP_MAX_SESSIONS."""
+
+import asyncio
+
+import main
+
+
+class _FakeRequest:
+    """Requête minimale pour mcp_sse_get (client toujours connecté)."""
+
+    headers = {"host": "test"}
+
+    class base_url:
+        hostname = "test"
+
+    async def is_disconnected(self) -> bool:
+        return False
+
+
+def test_evicted_sse_stream_ends(monkeypatch):
+    monkeypatch.setattr(main, "MCP_MAX_SESSIONS", 3)
+    main.mcp_sessions.clear()
+
+    async def scenario():
+        responses = [await main.mcp_sse_get(_FakeRequest()) for _ in range(main.MCP_MAX_SESSIONS + 1)]
+        assert len(main.mcp_sessions) == main.MCP_MAX_SESSIONS
+
+        first = responses[0].body_iterator
+        assert (await first.__anext__()).startswith("event: endpoint")
+        # La première session a été évincée : son stream se termine aussitôt
+        try:
+            await asyncio.wait_for(first.__anext__(), timeout=1.0)
+        except StopAsyncIteration:
+            pass
+        else:
+            raise AssertionError("le stream évincé devrait être terminé")
+
+        # Les sessions encore enregistrées restent ouvertes
+        last = responses[-1].body_iterator
+        await last.__anext__()
+        next_event = asyncio.ensure_future(last.__anext__())
+        await asyncio.sleep(0.05)
+        assert not next_event.done()
+        next_event.cancel()
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        main.mcp_sessions.clear()